@@ -3,6 +3,7 @@ import requests
 import yaml
 import gzip
 import io
+import threading
 import pandas as pd
 import numpy as np
 from logger import logger
@@ -10,15 +11,41 @@ from logger import logger
 from endpoints.scripts import get_notification_rate, brasilio
 from endpoints import get_cnes
 from endpoints.helpers import allow_local
+from utils import build_cache_path
+
+# Tabelas já conferidas com o Brasil.io nessa rodada (compartilhadas entre cidades e estados)
+_checked_tables = set()
+_download_lock = threading.Lock()
 
 
 def download_brasilio_table(dataset="covid19", table_name="caso_full"):
     """
     Baixa dados completos do Brasil.io e retorna CSV.
+
+    O arquivo fica em cache local e só é baixado de novo quando muda no servidor
+    (ETag/Last-Modified). A conferência é feita uma vez por rodada.
     """
-    api = brasilio.BrasilIO()
-    response = api.download(dataset, table_name)
-    return io.TextIOWrapper(gzip.GzipFile(fileobj=response), encoding="utf-8")
+    path = build_cache_path("brasilio", dataset, f"{table_name}.csv.gz")
+
+    with _download_lock:
+        if path not in _checked_tables:
+            try:
+                updated = brasilio.BrasilIO().download_if_modified(
+                    dataset, table_name, path
+                )
+                logger.info(
+                    "BRASILIO {} {}",
+                    table_name,
+                    "DOWNLOADED" if updated else "NOT MODIFIED, USING CACHE",
+                )
+            except Exception as e:
+                if not os.path.exists(path):
+                    raise
+                logger.warning("BRASILIO {} NOT CHECKED, USING CACHE: {}", table_name, e)
+
+            _checked_tables.add(path)
+
+    return io.TextIOWrapper(gzip.open(path), encoding="utf-8")
 
 
 def treat_df(df, config, place_type="city", place_id="city_ibge_code"):
@@ -44,11 +71,9 @@ def treat_df(df, config, place_type="city", place_id="city_ibge_code"):
     df["date"] = pd.to_datetime(df["date"])
     df = df.sort_values([place_id, "date"])
 
-    # Filtra até ultima data
-    last_updated = df[df["is_last"] == True].set_index(place_id)["date"]
-    groups = df.groupby(place_id)
-    idxs = groups.apply(lambda group: group["date"] <= last_updated[group.name])
-    df = df.loc[idxs[idxs == True].index.get_level_values(level=1)]
+    # Filtra até ultima data: compara cada linha com a última data do seu local
+    last_updated = df[df["is_last"] == True].groupby(place_id)["date"].max()
+    df = df[df["date"] <= df[place_id].map(last_updated)]
 
     # Transforma negativos para zero
     df.loc[df["new_confirmed"] < 0, "new_confirmed"] = 0
@@ -108,51 +133,85 @@ def get_default_ids(df, config, place_type="city"):
     return df
 
 
-def get_rolling_indicators(group, config, cols=["daily_cases"], weighted=True):
+def _rolling(values, group_pos, window, min_periods, how="sum"):
     """
-    Calcula variáveis dependentes do tempo: média móvel de casos, soma de casos nos dias de progressão da doença, 
+    Janela móvel sobre todos os locais de uma vez, sem atravessar a fronteira entre
+    locais: `values` está ordenado por local e `group_pos` é a posição de cada linha
+    dentro do seu local. Ignora nulos como o `rolling` do pandas.
     """
-    divide = group["population"].values[0] / 10 ** 5 if weighted else 1
+    total = np.zeros(len(values))
+    count = np.zeros(len(values))
+
+    for lag in range(min(window, len(values))):
+        shifted = np.full(len(values), np.nan)
+        shifted[lag:] = values[: len(values) - lag]
+        shifted[group_pos < lag] = np.nan
 
-    group = group.set_index("last_updated")
+        valid = ~np.isnan(shifted)
+        total += np.where(valid, shifted, 0)
+        count += valid
+
+    result = total if how == "sum" else total / np.where(count > 0, count, 1)
+    return np.where(count >= min_periods, result, np.nan)
+
+
+def get_rolling_indicators(df, config, place_id, cols=["daily_cases"], weighted=True):
+    """
+    Calcula variáveis dependentes do tempo para todos os locais de uma vez: média móvel de casos, soma de casos nos dias de progressão da doença, casos por 100k habitantes e tendência.
+
+    Args:
+        place_id (str): coluna que identifica o local; as janelas seguem a ordem das linhas de cada local
+    """
+    # Ordena por local mantendo a ordem das linhas dentro de cada local
+    df = df.dropna(subset=[place_id]).sort_values(place_id, kind="mergesort")
+    df = df.reset_index(drop=True)
+
+    new_group = (df[place_id] != df[place_id].shift()).values
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(df)), 0))
+    group_pos = np.arange(len(df)) - group_start
+
+    divide = df["population"].values[group_start] / 10 ** 5 if weighted else 1
 
     for col in cols:
+        values = df[col].values.astype(float)
+
         # Soma de casos nos dias de progressão da doença (para calculo de casos ativos)
         if col == "daily_cases":
             infectious_period = (
                 config["br"]["seir_parameters"]["severe_duration"]
                 + config["br"]["seir_parameters"]["critical_duration"]
             )
-            group["infectious_period_cases"] = (
-                group[col].rolling(window=infectious_period, min_periods=1).sum()
+            df["infectious_period_cases"] = _rolling(
+                values, group_pos, infectious_period, min_periods=1
             )
 
         # Calcula média móvel
-        group[f"{col}_mavg"] = (
-            group[col].rolling(window=7, min_periods=7).mean().round(1)
-        )
-        group[f"{col}_mavg_100k"] = group[f"{col}_mavg"] / divide
+        mavg = np.round(_rolling(values, group_pos, 7, min_periods=7, how="mean"), 1)
+        df[f"{col}_mavg"] = mavg
+        df[f"{col}_mavg_100k"] = mavg / divide
 
         # Calcula tendência
-        group[f"{col}_diff_14_days"] = (
-            np.sign(group[f"{col}_mavg"].diff()).rolling(14, min_periods=14).sum()
+        diff = np.where(group_pos > 0, mavg - np.roll(mavg, 1), np.nan)
+        df[f"{col}_diff_14_days"] = _rolling(
+            np.sign(diff), group_pos, 14, min_periods=14
+        )
+        df[f"{col}_growth"] = np.select(
+            [df[f"{col}_diff_14_days"] >= 5, df[f"{col}_diff_14_days"] <= -14],
+            ["crescendo", "decrescendo"],
+            default="estabilizando",
         )
-        group[f"{col}_growth"] = "estabilizando"
-        group.loc[
-            lambda x: x[f"{col}_diff_14_days"] >= 5, f"{col}_growth"
-        ] = "crescendo"
-        group.loc[
-            lambda x: x[f"{col}_diff_14_days"] <= -14, f"{col}_growth"
-        ] = "decrescendo"
 
-    return group.reset_index()
+    return df
 
 
-def _get_notification_rate(df, place_id="health_region_id"):
+def _get_notification_rate(df, config, place_id="health_region_id"):
     """
-    Get notification rates.
+    Get notification rates. The estimation method comes from
+    config["br"]["notification_rate"]["method"]: "simulation" (default) or
+    "analytic" (see `get_notification_rate.bin_neg_simulation`).
     """
-    notification = get_notification_rate.now(df, place_id)
+    method = config["br"].get("notification_rate", {}).get("method", "simulation")
+    notification = get_notification_rate.now(df, place_id, method=method)
 
     # Conserta tipo para merge
     notification[place_id] = notification[place_id].astype(str)
@@ -197,15 +256,13 @@ def now(config):
     logger.info("FINISH DATA TREATMENT")
 
     # Gera métricas de média móvel e tendência
-    groups = df.groupby("city_id", as_index=False)
-    df = groups.apply(
-        lambda x: get_rolling_indicators(x, config, cols=["daily_cases", "new_deaths"])
+    df = get_rolling_indicators(
+        df, config, place_id="city_id", cols=["daily_cases", "new_deaths"]
     )
-    df = df.reset_index(drop=True)
     logger.info("FINISH DATA GROW CALCULATION")
 
     # Gera dados de taxa de notificacao
-    df = _get_notification_rate(df)
+    df = _get_notification_rate(df, config)
     logger.info("FINISH NOTIFICATION RATE CALCULATION")
 
     # Calcula casos ativos
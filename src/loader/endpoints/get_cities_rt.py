@@ -1,11 +1,14 @@
 # code originally from (only minor updates):
 # https://github.com/loft-br/realtime_r0_brazil/blob/master/realtime_r0_bettencourt_ribeiro.ipynb
 
+import os
+import hashlib
 import numpy as np
 import pandas as pd
 import datetime as dt
 from scipy import stats as sps
-from joblib import Parallel, delayed
+from pyarrow import feather
+from joblib import Parallel, delayed, effective_n_jobs
 from loguru import logger
 
 # from utils import get_cases_series
@@ -13,6 +16,8 @@ from endpoints import get_cities_cases
 from endpoints.get_cities_cases import get_rolling_indicators
 
 from endpoints.helpers import allow_local
+from endpoints.scripts import epiestim_rt
+from utils import build_cache_path
 
 
 def get_cases_series(df, place_id, min_days):
@@ -149,13 +154,61 @@ def calculate_posteriors(sr, params, serial_interval):
     return posteriors
 
 
+def hdi_matrix(posteriors, r_t_range, p=0.95):
+    """
+    Function to calculate most likely Rt and highest density interval
+    for every column of a posterior matrix at once
+    Arguments
+    ----------
+    posteriors: array (Rt grid x columns) of posterior distributions
+    r_t_range: Rt grid
+    p: mass of high density interval
+    Returns 
+    ----------
+    intervals: array (columns x 3) with most likely, low and high Rt
+    ok: columns where an interval with mass > p exists
+    See also
+    ----------
+    Same interval as the N x N search of the Realtime R0 code: for each low,
+    the first high with cumsum[high] - cumsum[low] > p is found by binary
+    search (the difference grows with high), and the narrowest pair wins,
+    the lowest one on ties.
+    """
+
+    n, m = posteriors.shape
+    cumsum = np.cumsum(posteriors, axis=0)
+    cols = np.arange(m)
+
+    # Binary search of the first high for every (low, column)
+    lo = np.zeros((n, m), dtype=int)
+    hi = np.full((n, m), n)
+    while (lo < hi).any():
+        mid = (lo + hi) // 2
+        above = cumsum[np.minimum(mid, n - 1), cols] - cumsum > p
+        searching = lo < hi
+        hi = np.where(searching & above, mid, hi)
+        lo = np.where(searching & ~above, mid + 1, lo)
+
+    width = np.where(lo < n, lo - np.arange(n)[:, None], n + 1)
+    lows = width.argmin(axis=0)
+    highs = lows + width[lows, cols]
+    ok = width[lows, cols] <= n
+
+    intervals = np.full((m, 3), np.nan)
+    intervals[:, 0] = r_t_range[posteriors.argmax(axis=0)]
+    intervals[ok, 1] = r_t_range[lows[ok]]
+    intervals[ok, 2] = r_t_range[highs[ok]]
+
+    return intervals, ok
+
+
 def highest_density_interval(pmf, p=0.95):
     """
     Function to calculate highest density interval 
     from posteriors of Rt over time
     Arguments
     ----------
-    pmf: posterior distribution of Rt
+    pmf: posterior distribution of Rt (Series or DataFrame with one column per day)
     p: mass of high density interval
     Returns 
     ----------
@@ -167,32 +220,18 @@ def highest_density_interval(pmf, p=0.95):
     https://github.com/k-sys/covid-19/blob/master/Realtime%20R0.ipynb
     """
 
-    # If we pass a DataFrame, just call this recursively on the columns
-    if isinstance(pmf, pd.DataFrame):
-        return pd.DataFrame(
-            [highest_density_interval(pmf[col], p=p) for col in pmf], index=pmf.columns
-        )
-
-    cumsum = np.cumsum(pmf.values)
+    names = ["Rt_most_likely", f"Rt_low_{p*100:.0f}", f"Rt_high_{p*100:.0f}"]
 
-    # N x N matrix of total probability mass for each low, high
-    total_p = cumsum - cumsum[:, None]
+    values = pmf.values if isinstance(pmf, pd.DataFrame) else pmf.values[:, None]
+    intervals, ok = hdi_matrix(values, pmf.index.values, p=p)
 
-    # Return all indices with total_p > p
-    lows, highs = (total_p > p).nonzero()
+    if not ok.all():
+        raise ValueError(f"No interval with more than {p} of the posterior mass")
 
-    # Find the smallest range (highest density)
-    best = (highs - lows).argmin()
-
-    low = pmf.index[lows[best]]
-    high = pmf.index[highs[best]]
-    most_likely = pmf.idxmax(axis=0)
+    if isinstance(pmf, pd.DataFrame):
+        return pd.DataFrame(intervals, index=pmf.columns, columns=names)
 
-    interval = pd.Series(
-        [most_likely, low, high],
-        index=["Rt_most_likely", f"Rt_low_{p*100:.0f}", f"Rt_high_{p*100:.0f}"],
-    )
-    return interval
+    return pd.Series(intervals[0], index=names)
 
 
 def run_full_model(cases, config):
@@ -217,41 +256,460 @@ def run_full_model(cases, config):
 def sequential_run(df, config, place_id="city_id"):
 
     results = []
-    errors = 0
-    for gr in df.groupby(level=place_id):
+    errors = dict()
+    for place, cases in df.groupby(level=place_id):
 
         try:
-            results.append(run_full_model(gr[1], config))
-        except:
-            errors += 1
-            pass
+            results.append(run_full_model(cases, config))
+        except Exception as e:
+            errors[place] = repr(e)
 
-    logger.info("PLACES NOT EVALUATED: {}", errors)
+    _log_errors(errors)
 
     return pd.concat(results).reset_index()
 
 
-def get_rt(df, place_id, config):
+def build_model(params, serial_interval):
+    """
+    Function to build the parts of the Bayesian model shared by every place
+    Arguments
+    ----------
+    params: Rt parameters from config
+    serial_interval: serial interval of the disease
+    Returns 
+    ----------
+    r_t_range: grid of Rt values
+    process_matrix: gaussian process matrix, normalized by column
+    prior0: gamma prior of the first day
+    lam_factor: factor of the Poisson lambda for each Rt value
+    """
+
+    r_t_range = np.linspace(
+        0, int(params["r_t_range_max"]), int(params["r_t_range_max"]) * 100 + 1
+    )
+
+    process_matrix = sps.norm(loc=r_t_range, scale=params["optimal_sigma"]).pdf(
+        r_t_range[:, None]
+    )
+    process_matrix /= process_matrix.sum(axis=0)
+
+    prior0 = sps.gamma(a=params["gamma_alpha"]).pdf(r_t_range)
+    prior0 /= prior0.sum()
+
+    lam_factor = np.exp((r_t_range - 1) / serial_interval)
+
+    return r_t_range, process_matrix, prior0, lam_factor
+
+
+def calculate_batch(
+    cases, model, p=0.95, posteriors=None, last_cases=None, checkpoint_day=None
+):
+    """
+    Function to run the Bayes recursion for many places at once
+    Arguments
+    ----------
+    cases: array (days x places) of smoothed cases aligned on a common date
+           axis, NaN where the place has no observation
+    model: output of `build_model`
+    posteriors: posterior of each place before the first day (default prior)
+    last_cases: cases of the observation before the first day (default none)
+    checkpoint_day: day to keep each place's posterior from, -1 to skip
+    Returns 
+    ----------
+    intervals: array (days x places x 3) with most likely, low and high Rt,
+               NaN where the place has no observation
+    failed_day: first day where the place's interval could not be
+                calculated, -1 if none
+    checkpoints: array (Rt values x places) with the posterior of each place
+                 on its checkpoint day, NaN if skipped
+    See also
+    ----------
+    Same model as `calculate_posteriors`: each place's posterior only moves
+    on the days it has an observation, so gaps behave as consecutive days.
+    """
+
+    r_t_range, process_matrix, prior0, lam_factor = model
+
+    n_days, n_places = cases.shape
+    intervals = np.full((n_days, n_places, 3), np.nan)
+    failed_day = np.full(n_places, -1)
+
+    if posteriors is None:
+        posteriors = np.repeat(prior0[:, None], n_places, axis=1)
+    else:
+        posteriors = posteriors.copy()
+
+    if last_cases is None:
+        last_cases = np.full(n_places, np.nan)
+    else:
+        last_cases = last_cases.copy()
+
+    if checkpoint_day is None:
+        checkpoint_day = np.full(n_places, -1)
+    checkpoints = np.full((len(r_t_range), n_places), np.nan)
+
+    for day in range(n_days):
+
+        observed = ~np.isnan(cases[day])
+        update = observed & ~np.isnan(last_cases)
+
+        if update.any():
+            # Likelihood of today's cases given yesterday's
+            lam = last_cases[update] * lam_factor[:, None]
+            likelihoods = sps.poisson.pmf(cases[day, update], lam)
+
+            # Bayes' rule with the prior moved by the process matrix
+            numerator = likelihoods * (process_matrix @ posteriors[:, update])
+            posteriors[:, update] = numerator / numerator.sum(axis=0)
+
+        if observed.any():
+            day_intervals, ok = hdi_matrix(posteriors[:, observed], r_t_range, p)
+            intervals[day, observed] = day_intervals
+
+            new_failures = np.flatnonzero(observed)[~ok]
+            new_failures = new_failures[failed_day[new_failures] < 0]
+            failed_day[new_failures] = day
+
+        last_cases[observed] = cases[day, observed]
+
+        keep = checkpoint_day == day
+        checkpoints[:, keep] = posteriors[:, keep]
+
+    return intervals, failed_day, checkpoints
+
+
+def _log_errors(errors):
+
+    logger.info("PLACES NOT EVALUATED: {}", len(errors))
+
+    for place, reason in errors.items():
+        logger.debug("RT NOT EVALUATED FOR {}: {}", place, reason)
+
+
+def _digest(series):
+    # Fingerprint of the smoothed cases (dates and values) up to a checkpoint
+    return hashlib.sha1(
+        series.index.values.astype("datetime64[ns]").tobytes()
+        + series.values.astype(float).tobytes()
+    ).hexdigest()
+
+
+def _model_key(params, serial_interval):
+    return hashlib.sha1(
+        repr((sorted(params.items()), serial_interval)).encode()
+    ).hexdigest()
+
+
+def load_state(state_path, model_key):
+    """
+    Function to read the posteriors kept by the last run
+    Arguments
+    ----------
+    state_path: path prefix of the state files (.npz and .feather)
+    model_key: parameters of the model that wrote the state
+    Returns 
+    ----------
+    state: checkpoint of each place (str) with start and checkpoint dates, digest
+           of the smoothed cases up to the checkpoint, posterior and last cases
+    intervals: Rt already calculated for each place (str), up to the checkpoint
+    """
+
+    try:
+        with np.load(state_path + ".npz") as f:
+            if str(f["model_key"]) != model_key:
+                logger.info("RT PARAMETERS CHANGED, RECALCULATING ALL PLACES")
+                return dict(), dict()
+
+            state = {
+                place: {
+                    "start": pd.Timestamp(start),
+                    "checkpoint": pd.Timestamp(checkpoint),
+                    "digest": digest,
+                    "posterior": f["posteriors"][:, i],
+                    "last_cases": last_cases,
+                }
+                for i, (place, start, checkpoint, digest, last_cases) in enumerate(
+                    zip(
+                        f["places"],
+                        f["start"],
+                        f["checkpoint"],
+                        f["digest"],
+                        f["last_cases"],
+                    )
+                )
+            }
+
+        intervals = feather.read_feather(state_path + ".feather")
+
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        logger.info("NO RT STATE TO RESUME FROM: {!r}", e)
+        return dict(), dict()
+
+    return state, dict(tuple(intervals.groupby("place", sort=False)))
+
+
+def save_state(state_path, model_key, state, results, place_id):
+    """
+    Function to keep the posteriors of this run for the next one. Files are
+    replaced at once, so a failed run leaves the last state in place.
+    """
+
+    places = sorted(state.keys())
+    arrays = {
+        "model_key": np.array(model_key),
+        "places": np.array(places, dtype=str),
+        "start": np.array([state[p]["start"] for p in places], dtype="datetime64[ns]"),
+        "checkpoint": np.array(
+            [state[p]["checkpoint"] for p in places], dtype="datetime64[ns]"
+        ),
+        "digest": np.array([state[p]["digest"] for p in places], dtype=str),
+        "posteriors": (
+            np.stack([state[p]["posterior"] for p in places], axis=1)
+            if places
+            else np.empty((0, 0))
+        ),
+        "last_cases": np.array([state[p]["last_cases"] for p in places], dtype=float),
+    }
+
+    with open(state_path + ".npz.tmp", "wb") as f:
+        np.savez(f, **arrays)
+
+    intervals = results.rename(columns={place_id: "place"})
+    intervals["place"] = intervals["place"].astype(str)
+    feather.write_feather(intervals, state_path + ".feather.tmp")
+
+    os.replace(state_path + ".feather.tmp", state_path + ".feather")
+    os.replace(state_path + ".npz.tmp", state_path + ".npz")
+
+
+def batch_run(
+    df, config, place_id="city_id", chunk_size=500, n_jobs=1, state_path=None
+):
+    """
+    Function to estimate Rt of all places in chunks of places, that can run
+    in parallel processes
+    Arguments
+    ----------
+    df: cases series indexed by place and date
+    n_jobs: number of worker processes (joblib), -1 to use all cores
+    state_path: path prefix to keep each place's posterior between runs, so
+                the next run only updates the new days (None to disable)
+    Returns 
+    ----------
+    result: Rt most likely and HDI by place and date
+    See also
+    ----------
+    The smoothed cases of a day only stop changing when the whole gaussian
+    window is known, so each place is checkpointed `gaussian_min_periods`
+    days before its last observation. A place resumes from its checkpoint if
+    the smoothed cases up to it are exactly the same as in the last run,
+    otherwise (revised history, new smoothed zero) it is fully recalculated.
+    """
+
+    params = config["br"]["rt_parameters"]
+    serial_interval = (
+        config["br"]["seir_parameters"]["mild_duration"] * 0.5
+        + config["br"]["seir_parameters"]["incubation_period"]
+    )
+    model = build_model(params, serial_interval)
+    model_key = _model_key(params, serial_interval)
+
+    # smoothing series
+    smoothed = []
+    errors = dict()
+    for place, cases in df.groupby(level=place_id):
+        try:
+            series = smooth_new_cases(cases, params)
+        except Exception as e:
+            errors[place] = f"smoothing failed: {e!r}"
+            continue
+
+        if len(series) == 0:
+            errors[place] = "no cases after the last smoothed zero"
+            continue
+        smoothed.append(series.reset_index(level=0, drop=True).rename(place))
+
+    # Align places on a common date axis: days x places
+    cases = pd.concat(smoothed, axis=1).sort_index() if smoothed else pd.DataFrame()
+    n_days, n_places = cases.shape
+
+    # Where each place starts: prior of the first day or last run's checkpoint
+    state, previous = load_state(state_path, model_key) if state_path else ({}, {})
+    posteriors = np.repeat(model[2][:, None], n_places, axis=1)
+    last_cases = np.full(n_places, np.nan)
+    resume_day = np.full(n_places, -1)
+    checkpoint_day = np.full(n_places, -1)
+
+    window = int(params["gaussian_min_periods"])
+    for i in range(n_places):
+        series = cases.iloc[:, i].dropna()
+
+        if len(series) > window:
+            checkpoint_day[i] = cases.index.get_loc(series.index[-window - 1])
+
+        last = state.get(str(cases.columns[i]))
+        if (
+            last is None
+            or last["start"] != series.index[0]
+            or last["checkpoint"] not in series.index
+            or _digest(series[: last["checkpoint"]]) != last["digest"]
+        ):
+            continue
+
+        kept = previous.get(
+            str(cases.columns[i]), pd.DataFrame(columns=["last_updated"])
+        )
+        kept = kept[kept["last_updated"] <= last["checkpoint"]]
+        if len(kept) != len(series[: last["checkpoint"]]):
+            continue
+
+        previous[str(cases.columns[i])] = kept
+        resume_day[i] = cases.index.get_loc(last["checkpoint"])
+        posteriors[:, i] = last["posterior"]
+        last_cases[i] = last["last_cases"]
+
+        # No new final day: keep the last checkpoint
+        if checkpoint_day[i] <= resume_day[i]:
+            checkpoint_day[i] = -1
+
+    resumed = resume_day >= 0
+    logger.info("RT RESUMED FOR {} OF {} PLACES", resumed.sum(), n_places)
+
+    # Days up to the checkpoint are already calculated
+    values = cases.values.copy()
+    values[np.arange(n_days)[:, None] <= resume_day[None, :]] = np.nan
+
+    # Enough chunks to keep every worker busy; workers only get arrays
+    n_workers = effective_n_jobs(n_jobs)
+    chunk_size = max(1, min(chunk_size, int(np.ceil(n_places / n_workers))))
+    chunks = [
+        slice(start, start + chunk_size) for start in range(0, n_places, chunk_size)
+    ]
+
+    outputs = Parallel(n_jobs=n_jobs)(
+        delayed(calculate_batch)(
+            values[:, chunk],
+            model,
+            posteriors=posteriors[:, chunk],
+            last_cases=last_cases[chunk],
+            checkpoint_day=checkpoint_day[chunk],
+        )
+        for chunk in chunks
+    )
+
+    results = []
+    new_state = dict()
+    for chunk, (intervals, failed_day, checkpoints) in zip(chunks, outputs):
+
+        for j, i in enumerate(range(n_places)[chunk]):
+            place = cases.columns[i]
+
+            if failed_day[j] >= 0:
+                errors[place] = "no 95% interval on {}".format(
+                    cases.index[failed_day[j]].date()
+                )
+                continue
+
+            if resumed[i]:
+                results.append(
+                    previous[str(place)]
+                    .rename(columns={"place": place_id})
+                    .assign(**{place_id: place})
+                )
+
+            observed = ~np.isnan(values[:, i])
+            results.append(
+                pd.DataFrame(
+                    {
+                        place_id: place,
+                        "last_updated": cases.index[observed],
+                        "Rt_most_likely": intervals[observed, j, 0],
+                        "Rt_low_95": intervals[observed, j, 1],
+                        "Rt_high_95": intervals[observed, j, 2],
+                    }
+                )
+            )
+
+            if checkpoint_day[i] >= 0:
+                checkpoint = cases.index[checkpoint_day[i]]
+                series = cases.iloc[:, i].dropna()
+                new_state[str(place)] = {
+                    "start": series.index[0],
+                    "checkpoint": checkpoint,
+                    "digest": _digest(series[:checkpoint]),
+                    "posterior": checkpoints[:, j],
+                    "last_cases": series[checkpoint],
+                }
+            elif resumed[i]:
+                new_state[str(place)] = state[str(place)]
+
+    _log_errors(errors)
+
+    result = pd.concat(results).reset_index(drop=True)
+
+    if state_path:
+        save_state(state_path, model_key, new_state, result, place_id)
+
+    return result
+
+
+def default_n_jobs():
+    # The Rt endpoints may run at the same time (see scheduler), so each one
+    # only takes its share of the cores
+    if os.getenv("RT_N_JOBS"):
+        return int(os.getenv("RT_N_JOBS"))
+
+    loader_workers = int(os.getenv("LOADER_MAX_WORKERS", 4))
+    return max(1, (os.cpu_count() or 1) // loader_workers)
+
+
+def get_rt(df, place_id, config, n_jobs=None, incremental=True, method=None):
+    """
+    Function to estimate Rt by place and date from the cases table
+    Arguments
+    ----------
+    n_jobs: worker processes for the Rt estimation, default from the
+            RT_N_JOBS env variable (if not set, the cores divided by the
+            endpoints the loader runs at once, LOADER_MAX_WORKERS)
+    incremental: resume each place from the posteriors kept by the last run
+                 (see `batch_run`)
+    method: "bayes" (Bettencourt & Ribeiro, default) or "cori" (EpiEstim's
+            parametric_si, see `scripts.epiestim_rt`), default from the
+            `method` of the Rt parameters in config
+    """
+
+    if n_jobs is None:
+        n_jobs = default_n_jobs()
+
+    if method is None:
+        method = config["br"]["rt_parameters"].get("method", "bayes")
+
+    if method not in ("bayes", "cori"):
+        raise ValueError(f"Unknown Rt method: {method}")
 
     # Filter 10 days ago (KEVIN & COVIDACTNOW)
     df = df[df["last_updated"] <= (df["last_updated"].max() - dt.timedelta(10))]
 
-    # Filter more than 14 days & get cases mavg
-    df = get_cases_series(df, place_id, config["br"]["rt_parameters"]["min_days"])
+    if method == "cori":
+        df = epiestim_rt.get_rt(df, place_id)
+        logger.info("FINISH CORI RT CALCULATION")
+
+    else:
+        # Filter more than 14 days & get cases mavg
+        df = get_cases_series(df, place_id, config["br"]["rt_parameters"]["min_days"])
 
-    # subs cidades com 0 casos -> 0.1 caso no periodo
-    df = df.replace(0, 0.1)
+        # subs cidades com 0 casos -> 0.1 caso no periodo
+        df = df.replace(0, 0.1)
 
-    # Run in parallel
-    df = sequential_run(df, config, place_id)
-    logger.info("FINISH SEQUENTIAL RT CALCULATION")
+        # Run all places at once, in parallel chunks
+        state_path = build_cache_path("rt", place_id) if incremental else None
+        df = batch_run(df, config, place_id, n_jobs=n_jobs, state_path=state_path)
+        logger.info("FINISH BATCH RT CALCULATION")
 
     # Get rolling avgs
-    groups = df.groupby(place_id, as_index=False)
-    df = groups.apply(
-        lambda x: get_rolling_indicators(x, config, cols=["Rt_most_likely"], weighted=False)
+    df = get_rolling_indicators(
+        df, config, place_id=place_id, cols=["Rt_most_likely"], weighted=False
     )
-    df = df.reset_index(drop=True)
     logger.info("FINISH DATA GROW CALCULATION")
     
     # Filter more than 14 days of calculated Rt
@@ -1,15 +1,14 @@
 import pandas as pd
 from datetime import datetime
 import numpy as np
-import time
-from selenium import webdriver
-from time import sleep
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 
 from endpoints.helpers import allow_local
 from endpoints import get_places_id
+from endpoints.scripts.tabnet import TabNet
 from utils import download_from_drive
 from logger import logger
 
@@ -36,173 +35,121 @@ def get_date(updatedate):
 
 
 def treat_city_name(df):
-    df["city_id"] = df["city_name"].split(" ", 1)[0]
-    df["city_name"] = df["city_name"].split(" ", 1)[1].strip("\n")
+    # Separa id e nome da cidade ("110001 Alta Floresta D'Oeste")
+    city = df["city_name"].str.split(" ", n=1)
+    df["city_id"] = city.str[0]
+    df["city_name"] = city.str[1].str.strip("\n")
     return df
 
 
-def get_leitos(driver, url):
-    driver.get(url)
-    sleep(15)
-    element = driver.find_elements_by_xpath("//option[@value='Município']")
-    element[0].click()
-    element = driver.find_elements_by_xpath("//option[@value='Especialidade']")
-    element[1].click()
-    updatedate = driver.find_element_by_id("A")
-    updatedate = updatedate.text[0:8]
-    element = driver.find_elements_by_class_name("mostra")
-    element[0].click()
-    df_leitos = pd.DataFrame(
-        columns=[
-            "city_name",
-            "cirurgico_tot",
-            "clinico_tot",
-            "pediatrico_tot",
-            "hospital_dia_tot",
-        ]
+def _get_cells(html):
+    """Textos das células e número de linhas da tabela de resultado do TabNet"""
+    table = BeautifulSoup(html, "html.parser").find(class_="tabdados")
+    return [td.text for td in table.select("td")], len(table.select("tr"))
+
+
+def _get_table(html, columns, start, step):
+    """
+    Monta a tabela de uma vez a partir das células do TabNet: uma linha por
+    município (as 4 primeiras linhas são cabeçalho), começando na célula
+    `start` e andando `step` células por linha.
+
+    Parameters
+    ----------
+    columns: dict
+        Nome de cada coluna e sua posição a partir do início da linha
+    """
+    x, n_rows = _get_cells(html)
+    x = np.array(x, dtype=object)
+    rows = start + step * np.arange(max(n_rows - 4, 0))
+
+    df = pd.DataFrame({name: x[rows + offset] for name, offset in columns.items()})
+    return treat_city_name(df)
+
+
+def get_leitos(tabnet, definition):
+    form = tabnet.form(definition)
+    html = tabnet.query(form, Linha="Município", Coluna="Especialidade")
+    updatedate = form["updated"][0:8]
+    df_leitos = _get_table(
+        html,
+        {
+            "city_name": 0,
+            "cirurgico_tot": 1,
+            "clinico_tot": 2,
+            "pediatrico_tot": 4,
+            "hospital_dia_tot": 7,
+        },
+        start=10,
+        step=8,
     )
-    tableRows = driver.find_elements_by_class_name("tabdados")
-    html = tableRows[0].get_attribute("innerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    x = soup.select("td")
-    y = soup.select("tr")
-    i = 0
-    k = 10
-    for j in range(4, len(y)):
-        df_leitos.loc[i] = [
-            x[k].text,
-            x[k + 1].text,
-            x[k + 2].text,
-            x[k + 4].text,
-            x[k + 7].text,
-        ]
-        k = k + 8
-        i = i + 1
-
-    df_leitos = df_leitos.apply(treat_city_name, axis=1)
     return df_leitos, updatedate
 
 
-def get_respiradores(driver, url):
-    driver.get(url)
-    sleep(15)
-    element = driver.find_elements_by_xpath("//option[@value='Município']")
-    element[0].click()
-    element = driver.find_elements_by_xpath("//option[@value='Equipamento']")
-    element[1].click()
-    element = driver.find_elements_by_class_name("mostra")
-    sleep(15)
-    element[0].click()
-    sleep(15)
-    tableRows = driver.find_elements_by_class_name("tabdados")
-    html = tableRows[0].get_attribute("innerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    df_respiradores = pd.DataFrame(columns=["city_name", "number_ventilators"])
-    x = soup.select("td")
-    y = soup.select("tr")
-    i = 0
-    k = 85
-    for j in range(4, len(y)):
-        df_respiradores.loc[i] = [x[k].text, x[k + 54].text]
-        k = k + 83
-        i = i + 1
-
-    df_respiradores = df_respiradores.apply(treat_city_name, axis=1)
+def get_respiradores(tabnet, definition):
+    form = tabnet.form(definition)
+    html = tabnet.query(form, Linha="Município", Coluna="Equipamento")
+    df_respiradores = _get_table(
+        html, {"city_name": 0, "number_ventilators": 54}, start=85, step=83
+    )
     return df_respiradores
 
 
-def get_urlleitoscomp(driver, url):
-    driver.get(url)
-    element = driver.find_elements_by_xpath("//option[@value='Município']")
-    element[0].click()
-    element = driver.find_elements_by_xpath("//option[@value='Leitos_complementares']")
-    element[1].click()
-    element = driver.find_elements_by_class_name("mostra")
-    element[0].click()
-    tableRows = driver.find_elements_by_class_name("tabdados")
-    html = tableRows[0].get_attribute("innerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    df_leitos_comp = pd.DataFrame(
-        columns=[
-            "city_name",
-            "UTI_adulto_I_tot",
-            "UTI_adulto_II_tot",
-            "UTI_adulto_III_tot",
+def get_urlleitoscomp(tabnet, definition):
+    form = tabnet.form(definition)
+
+    # Total, SUS e não SUS: consultas independentes, feitas ao mesmo tempo
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        pages = [
+            executor.submit(
+                tabnet.query,
+                form,
+                Linha="Município",
+                Coluna="Leitos_complementares",
+                **incremento,
+            )
+            for incremento in [
+                dict(),
+                {"Incremento": "Quantidade_SUS"},
+                {"Incremento": "Quantidade_Não_SUS"},
+            ]
         ]
+    html, html_sus, html_nao_sus = [page.result() for page in pages]
+
+    df_leitos_comp = _get_table(
+        html,
+        {
+            "city_name": 0,
+            "UTI_adulto_I_tot": 5,
+            "UTI_adulto_II_tot": 6,
+            "UTI_adulto_III_tot": 7,
+        },
+        start=24,
+        step=22,
     )
 
-    x = soup.select("td")
-    y = soup.select("tr")
-    i = 0
-    k = 24
-    for j in range(4, len(y)):
-        df_leitos_comp.loc[i] = [x[k].text, x[k + 5].text, x[k + 6].text, x[k + 7].text]
-        k = k + 22
-        i = i + 1
-
-    # Separa id e nome da cidade
-    df_leitos_comp = df_leitos_comp.apply(treat_city_name, axis=1)
-
-    element = driver.find_elements_by_class_name("botao_opcao")
-    element[4].click()
-    sleep(15)
-    element = driver.find_elements_by_xpath("//option[@value='Quantidade_existente']")
-    element[0].click()
-    element = driver.find_elements_by_xpath("//option[@value='Quantidade_SUS']")
-    element[0].click()
-    element = driver.find_elements_by_class_name("mostra")
-    element[0].click()
-    tableRows = driver.find_elements_by_class_name("tabdados")
-    html = tableRows[0].get_attribute("innerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    df_Leitos_compl_SUS = pd.DataFrame(
-        columns=["city_name", "UTI_adulto_II_COVID_SUS", "UTI_pediatrica_II_COVID_SUS",]
+    df_Leitos_compl_SUS = _get_table(
+        html_sus,
+        {
+            "city_name": 0,
+            "UTI_adulto_II_COVID_SUS": 1,
+            "UTI_pediatrica_II_COVID_SUS": 2,
+        },
+        start=24,
+        step=22,
     )
 
-    x = soup.select("td")
-    y = soup.select("tr")
-    i = 0
-    k = 24
-    for j in range(4, len(y)):
-        df_Leitos_compl_SUS.loc[i] = [x[k].text, x[k + 1].text, x[k + 2].text]
-        k = k + 22
-        i = i + 1
-
-    # Separa id e nome da cidade
-    df_Leitos_compl_SUS = df_Leitos_compl_SUS.apply(treat_city_name, axis=1)
-
-    element = driver.find_elements_by_class_name("botao_opcao")
-    element[4].click()
-    sleep(15)
-    element = driver.find_elements_by_xpath("//option[@value='Quantidade_SUS']")
-    element[0].click()
-    element = driver.find_elements_by_xpath("//option[@value='Quantidade_Não_SUS']")
-    element[0].click()
-    element = driver.find_elements_by_class_name("mostra")
-    element[0].click()
-    tableRows = driver.find_elements_by_class_name("tabdados")
-    html = tableRows[0].get_attribute("innerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    df_Leitos_compl_nao_SUS = pd.DataFrame(
-        columns=[
-            "city_name",
-            "UTI_adulto_II_COVID_nao_SUS",
-            "UTI_pediatrica_II_COVID_nao_SUS",
-        ]
+    df_Leitos_compl_nao_SUS = _get_table(
+        html_nao_sus,
+        {
+            "city_name": 0,
+            "UTI_adulto_II_COVID_nao_SUS": 1,
+            "UTI_pediatrica_II_COVID_nao_SUS": 2,
+        },
+        start=24,
+        step=22,
     )
 
-    x = soup.select("td")
-    y = soup.select("tr")
-    i = 0
-    k = 24
-    for j in range(4, len(y)):
-        df_Leitos_compl_nao_SUS.loc[i] = [x[k].text, x[k + 1].text, x[k + 2].text]
-        k = k + 22
-        i = i + 1
-
-    # Separa id e nome da cidade
-    df_Leitos_compl_nao_SUS = df_Leitos_compl_nao_SUS.apply(treat_city_name, axis=1)
-
     df_leitos_comp = df_leitos_comp.merge(
         df_Leitos_compl_SUS, how="left", on=["city_id", "city_name"]
     )
@@ -215,35 +162,28 @@ def get_urlleitoscomp(driver, url):
 
 @allow_local
 def now(config):
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--window-size=1420,1080")
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-
-    driver = webdriver.Chrome(
-        chrome_options=chrome_options
-    )  # chromedriver é instalado via dockerfile
-
-    # Pega dados de Leitos pela especialidade de todos os municipios #
-    logger.info("Baixando dados de leitos")
-    urlleitos = "http://tabnet.datasus.gov.br/cgi/deftohtm.exe?cnes/cnv/leiintbr.def"
-    df_leitos, updatedate = get_leitos(driver, urlleitos)
+    # Respostas gravadas do TabNet podem ser usadas para rodar sem rede
+    tabnet = TabNet(recordings=os.getenv("TABNET_RECORDINGS"))
+
+    # Leitos por especialidade, leitos complementares e respiradores de todos os
+    # municipios, baixados ao mesmo tempo
+    logger.info("Baixando dados de leitos, leitos UTI e respiradores")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leitos = executor.submit(get_leitos, tabnet, "cnes/cnv/leiintbr.def")
+        leitos_comp = executor.submit(
+            get_urlleitoscomp, tabnet, "cnes/cnv/leiutibr.def"
+        )
+        respiradores = executor.submit(
+            get_respiradores, tabnet, "cnes/cnv/equipobr.def"
+        )
+
+    df_leitos, updatedate = leitos.result()
+    df_leitos_comp = leitos_comp.result()
+    df_respiradores = respiradores.result()
+
     # Ultima data de atualizacao do dado CNES
     updatedate = get_date(updatedate)
 
-    # Pega dados de Leitos complementares de todos os municipios #
-    logger.info("Baixando dados de leitos UTI")
-    urlleitoscomp = (
-        "http://tabnet.datasus.gov.br/cgi/deftohtm.exe?cnes/cnv/leiutibr.def"
-    )
-    df_leitos_comp = get_urlleitoscomp(driver, urlleitoscomp)
-
-    # Pega dados de Respiradores dos Municipios #
-    logger.info("Baixando dados de respiradores")
-    urlresp = "http://tabnet.datasus.gov.br/cgi/deftohtm.exe?cnes/cnv/equipobr.def"
-    df_respiradores = get_respiradores(driver, urlresp)
-
     # Une os diferentes dataframes #
     df_cnes = df_leitos.merge(df_leitos_comp, how="left", on=["city_id", "city_name"])
     df_cnes = df_cnes.merge(df_respiradores, how="left", on=["city_id", "city_name"])
@@ -47,11 +47,9 @@ def now(config):
     logger.info("FINISH DATA TREATMENT")
 
     # Gera métricas de média móvel e tendência
-    groups = df.groupby("health_region_id", as_index=False)
-    df = groups.apply(
-        lambda x: get_rolling_indicators(x, config, cols=["daily_cases", "new_deaths"])
+    df = get_rolling_indicators(
+        df, config, place_id="health_region_id", cols=["daily_cases", "new_deaths"]
     )
-    df = df.reset_index(drop=True)
     logger.info("FINISH DATA GROW CALCULATION")
 
     # Calcula casos ativos
@@ -14,7 +14,7 @@ from endpoints import (
 )
 
 from endpoints.helpers import allow_local
-from endpoints.scripts.simulator import run_simulation
+from endpoints.scripts.simulator import run_simulation_batch
 
 
 def _get_levels(df, rules):
@@ -133,106 +133,110 @@ def get_control_indicators(
 
 
 # CAPACITY
-def _calculate_recovered(df, params):
+def _calculate_recovered(params):
 
-    confirmed_adjusted = int(df[["confirmed_cases"]].sum() / df["notification_rate"])
-
-    if confirmed_adjusted == 0:  # dont have any cases yet
-        params["population_params"]["R"] = 0
-        return params
-
-    params["population_params"]["R"] = (
-        confirmed_adjusted
-        - params["population_params"]["I"]
-        - params["population_params"]["D"]
+    confirmed_adjusted = np.trunc(
+        params["confirmed_cases"].fillna(0) / params["notification_rate"]
     )
 
-    if params["population_params"]["R"] < 0:
-        params["population_params"]["R"] = (
-            confirmed_adjusted - params["population_params"]["D"]
-        )
+    recovered = confirmed_adjusted - params["I"] - params["D"]
+    recovered = recovered.where(recovered >= 0, confirmed_adjusted - params["D"])
 
-    return params
+    # dont have any cases yet
+    return recovered.where(confirmed_adjusted != 0, 0)
 
 
-# TODO: rever para colocar num script a parte!
-def _prepare_simulation(row, place_id, config, place_specific_params, rt_upper=None):
+def get_capacity_projection(df, place_id, config, place_specific_params, rt_upper=None):
+    """
+    Projeta o dia de ocupação total dos leitos de UTI de todos os locais de uma vez
+    (ver `simulator.run_simulation_batch`).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Locais indexados por `place_id`, com os indicadores de situação, controle e
+        confiança já calculados
+    place_specific_params : pd.DataFrame
+        Proporções de infectados e letalidade por `place_id`
+    rt_upper : pd.DataFrame
+        Rt do nível acima (estados), usado quando o local não tem Rt
+
+    Returns
+    -------
+    pd.Series
+        Dias até ocupação total dos leitos de UTI no melhor cenário (-1 se não
+        acontecer em 90 dias), NaN para locais sem dados para a projeção
+    """
 
-    # based on Alison Hill: 40% asymptomatic
-    symtomatic = [
-        int(
-            row["active_cases"]
-            * (1 - config["br"]["seir_parameters"]["asymptomatic_proportion"])
+    seir_params = ["fatality_ratio", "i1_percentage", "i2_percentage", "i3_percentage"]
+    params = df.join(place_specific_params.set_index(place_id)[seir_params])
+
+    # Seleciona rt de 1 nivel acima caso não tenha
+    if rt_upper is not None:
+        rt_upper = rt_upper.assign(
+            last_updated=lambda df: pd.to_datetime(df["last_updated"])
         )
-        if not np.isnan(row["active_cases"])
-        else 1
-    ][0]
-
-    params = {
-        "population_params": {
-            "N": int(row["population"]),
-            "I": symtomatic,
-            "D": [int(row["deaths"]) if not np.isnan(row["deaths"]) else 0][0],
-        },
-        "place_specific_params": {
-            "fatality_ratio": place_specific_params["fatality_ratio"].loc[
-                int(row.name)
-            ],
-            "i1_percentage": place_specific_params["i1_percentage"].loc[int(row.name)],
-            "i2_percentage": place_specific_params["i2_percentage"].loc[int(row.name)],
-            "i3_percentage": place_specific_params["i3_percentage"].loc[int(row.name)],
-        },
-        "n_beds": row["number_beds"]
-        * config["br"]["simulacovid"]["resources_available_proportion"],
-        "n_icu_beds": row["number_icu_beds"]
-        * config["br"]["simulacovid"]["resources_available_proportion"],
-        "R0": {
-            "best": row["rt_most_likely"],  # só usamos o "best" neste caso
-            "worst": row["rt_high_95"],
-        },
-    }
+        rt_upper = rt_upper[
+            rt_upper["last_updated"]
+            == rt_upper.groupby("state_num_id")["last_updated"].transform("max")
+        ].set_index("state_num_id")[["Rt_most_likely", "Rt_high_95"]]
 
-    # TODO: checar esses casos no calculo da subnotificacao!
-    if row["notification_rate"] != row["notification_rate"]:
-        return np.nan
+        rt_upper = params[["state_num_id"]].join(rt_upper, on="state_num_id")
 
-    if row["notification_rate"] == 0:
-        return np.nan
+        missing = params["rt_most_likely"].isnull()
+        params.loc[missing, "rt_most_likely"] = rt_upper["Rt_most_likely"]
+        params.loc[missing, "rt_high_95"] = rt_upper["Rt_high_95"]
 
-    # TODO: precisa? Seleciona rt de 1 nivel acima caso não tenha
-    if row["rt_most_likely"] != row["rt_most_likely"]:
-        if place_id == "health_region_id":
-            rt = rt_upper.query(f"state_num_id == {row['state_num_id']}")
-        else:
-            return np.nan
+    # based on Alison Hill: 40% asymptomatic
+    params["I"] = np.trunc(
+        params["active_cases"]
+        * (1 - config["br"]["seir_parameters"]["asymptomatic_proportion"])
+    ).fillna(1)
+    params["N"] = np.trunc(params["population"])
+    params["D"] = np.trunc(params["deaths"]).fillna(0)
+    params["R"] = _calculate_recovered(params)
 
-        if len(rt) > 0:
-            rt = rt.assign(
-                last_updated=lambda df: pd.to_datetime(df["last_updated"])
-            ).query("last_updated == last_updated.max()")
-            params["R0"] = {"best": rt["Rt_most_likely"], "worst": rt["Rt_high_95"]}
-        else:
-            return np.nan
+    # Só usamos o "best" neste caso
+    params["rt_high_95"] = params["rt_high_95"].fillna(params["rt_most_likely"])
 
-    params = _calculate_recovered(row, params)
+    # TODO: checar esses casos no calculo da subnotificacao!
+    columns = ["N", "I", "R", "D", "rt_most_likely", "rt_high_95"] + seir_params
+    params = params[
+        (params["notification_rate"] > 0)
+        & (params["N"] > 0)
+        & np.isfinite(params[columns]).all(axis=1)
+    ]
 
-    # Run simulation
-    dday = run_simulation(params, config)
-    return dday["beds"]["best"]
+    if len(params) == 0:
+        return pd.Series(np.nan, index=df.index)
+
+    proportion = config["br"]["simulacovid"]["resources_available_proportion"]
+    dday = run_simulation_batch(
+        {
+            "population_params": {c: params[c].values for c in ["N", "I", "R", "D"]},
+            "place_specific_params": {c: params[c].values for c in seir_params},
+            "n_beds": params["number_beds"].values * proportion,
+            "n_icu_beds": params["number_icu_beds"].values * proportion,
+            "R0": {
+                "best": params["rt_most_likely"].values,
+                "worst": params["rt_high_95"].values,
+            },
+        },
+        config,
+    )
+
+    return pd.Series(dday["icu_beds"]["best"], index=params.index).reindex(df.index)
 
 
 def get_capacity_indicators(df, place_id, config, rules, classify, data=None):
 
-    # TODO -> VOLTAR PROJECAO DE LEITOS
-    # if place_id == "health_region_id":
-    #     rt_upper = get_states_rt.now(config)
-    #     place_specific_params = get_health_region_parameters.now(config).set_index(
-    #         place_id
-    #     )
+    if place_id == "health_region_id":
+        rt_upper = get_states_rt.now(config)
+        place_specific_params = get_health_region_parameters.now(config)
 
-    # if place_id == "state_num_id":
-    #     rt_upper = None
-    #     place_specific_params = get_states_parameters.now(config).set_index(place_id)
+    if place_id == "state_num_id":
+        rt_upper = None
+        place_specific_params = get_states_parameters.now(config)
 
     # Pega valores calculados para regional e soma total de leitos
     if place_id == "city_id":
@@ -241,7 +245,7 @@ def get_capacity_indicators(df, place_id, config, rules, classify, data=None):
             .merge(
                 data[
                     [
-                        # "dday_icu_beds",
+                        "dday_icu_beds",
                         "number_beds",
                         "number_icu_beds",
                         "health_region_id",
@@ -254,14 +258,11 @@ def get_capacity_indicators(df, place_id, config, rules, classify, data=None):
             .set_index("city_id")
         )
 
-    # else:
-    #     df["dday_icu_beds"] = df.apply(
-    #         lambda row: _prepare_simulation(
-    #             row, place_id, config, place_specific_params, rt_upper
-    #         ),
-    #         axis=1,
-    #     )
-    # df["dday_icu_beds"] = df["dday_icu_beds"].replace(-1, 91)
+    else:
+        df["dday_icu_beds"] = get_capacity_projection(
+            df, place_id, config, place_specific_params, rt_upper
+        )
+    df["dday_icu_beds"] = df["dday_icu_beds"].replace(-1, 91)
 
     # Classificação: numero de dias para acabar a capacidade - MUDANÇA: leitos UTI por 100k
     df["number_icu_beds_100k"] = (10 ** 5) * (df["number_icu_beds"] / df["population"])
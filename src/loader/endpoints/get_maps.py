@@ -8,73 +8,88 @@ import warnings
 
 warnings.filterwarnings("ignore")
 
-# Plotting
-import plotly
-import plotly.graph_objs as go
-import cufflinks as cf
-
-plotly.offline.init_notebook_mode(connected=True)
 # Getting helping data
 from endpoints import get_states_farolcovid_main, get_cities_farolcovid_main
 import utils
 
-# Setting cufflinks
-import textwrap
-import cufflinks as cf
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-cf.go_offline()
-cf.set_config_file(offline=False, world_readable=True)
+from endpoints.scripts.datawrapper_api import Datawrapper
+from logger import logger
 
-# Centering and fixing title
-def iplottitle(title, width=40):
-    return "<br>".join(textwrap.wrap(title, width))
+import os
 
 
-# import geobr
-import yaml
-from plotly.offline import download_plotlyjs, plot, iplot
-import random
+def get_map_data(config, states):
+    """
+    Carrega os dados do Farol uma vez para todos os mapas.
 
-from datawrapper import Datawrapper
+    Parameters
+    ----------
+    config : dict
+    states : list
+        Estados com mapa de cidades
 
-import os
+    Returns
+    -------
+    (dict, pd.DataFrame)
+        Dados das cidades de cada estado e dados de todos os estados
+    """
+    cities = get_cities_farolcovid_main.now(config)
+    by_state = dict(tuple(cities.groupby("state_id")))
+
+    cities_data = {
+        state_id: by_state.get(state_id, cities.iloc[0:0]) for state_id in states
+    }
+    return cities_data, get_states_farolcovid_main.now(config)
 
 
 class Map:
     def __init__(
-        self, config, map_folder_id, access_token=None, basemapCMD=None, state_id=None
+        self,
+        config,
+        map_folder_id,
+        access_token=None,
+        basemapCMD=None,
+        state_id=None,
+        data=None,
+        dw=None,
     ):
 
         self.config = config
         self.map_folder_id = map_folder_id
-        self.dw = Datawrapper(access_token)
+        self.dw = dw or Datawrapper(access_token)
         self.basemapCMD = basemapCMD
         self.state_id = state_id
 
         # __dadosFarol__
-        self.map_data = self.__dadosFarol__()
+        self.map_data = self.__dadosFarol__(data)
 
-    def __dadosFarol__(self):
-        # Puxa os dados do Farol
+    def __dadosFarol__(self, data=None):
+        # Puxa os dados do Farol, caso nao tenham sido passados (cidades do
+        # estado ou todos os estados)
 
         if self.state_id:
-            data = (
-                get_cities_farolcovid_main.now(self.config)
-                .query(f"state_id == '{self.state_id}'")[
-                    [
-                        "city_id",
-                        "city_name",
-                        "overall_alert",
-                        "deaths",
-                        "subnotification_rate",
-                    ]
+            if data is None:
+                data = get_cities_farolcovid_main.now(self.config).query(
+                    f"state_id == '{self.state_id}'"
+                )
+            data = data[
+                [
+                    "city_id",
+                    "city_name",
+                    "overall_alert",
+                    "deaths",
+                    "subnotification_rate",
                 ]
-                .rename(columns={"city_id": "ID"})
-            )
+            ].rename(columns={"city_id": "ID"})
         else:
+            if data is None:
+                data = get_states_farolcovid_main.now(self.config)
             data = (
-                get_states_farolcovid_main.now(self.config)
-                .sort_values("state_id")
+                data.sort_values("state_id")
                 .reset_index(drop=True)[
                     [
                         "state_id",
@@ -96,6 +111,19 @@ class Map:
 
         return data
 
+    def hash(self, mapID):
+        # Hash do conteudo publicado no mapa (dados e layout: cores, legenda,
+        # tooltip), para saber se ele mudou
+        payload = "\n".join(
+            [
+                str(mapID),
+                str(self.basemapCMD),
+                json.dumps(self.layout(), sort_keys=True),
+                self.map_data.to_csv(index=False),
+            ]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16].upper()
+
     def createMap(self):
         # Cria o Mapa
         stateMap = self.dw.create_chart(
@@ -122,8 +150,8 @@ class Map:
         self.dw.update_chart(stateMap["publicId"], theme="datawrapper")
         return stateMap["publicId"]
 
-    def applyDefaultLayout(self, mapID):
-
+    def layout(self):
+        # Metadados do layout padrao do mapa
         # Colunas com dados a serem mostrados no hover
         fields = {
             "ID": "ID",
@@ -143,8 +171,7 @@ class Map:
             title = "{{ state_name }}"
             fields["state_name"] = "state_name"
 
-        # Aplica o layout
-        DEFAULT_LAYOUT = {
+        return {
             "data": {
                 "transpose": False,
                 "column-format": {
@@ -185,7 +212,9 @@ class Map:
             },
         }
 
-        self.dw.update_metadata(mapID, DEFAULT_LAYOUT)
+    def applyDefaultLayout(self, mapID):
+        # Aplica o layout
+        self.dw.update_metadata(mapID, self.layout())
 
     def updateMap(self, mapID):
         # Read farol data
@@ -196,11 +225,30 @@ class Map:
         self.dw.update_chart(mapID, title="")
 
 
+def get_published_hashes():
+    """
+    Hashes dos mapas publicados na ultima rodada (saida anterior desta endpoint),
+    por id do mapa.
+    """
+    endpoint = [l for l in utils.get_endpoints() if l["python_file"] == "get_maps"][0]
+
+    try:
+        published = utils.read_local(endpoint)
+    except FileNotFoundError:
+        return dict()
+
+    return dict(zip(published["map_id"].astype(str), published["hashes"].astype(str)))
+
+
 @allow_local
 def now(config):
     """This method is going to be called by main.py and it should return the output
     DataFrame.
 
+    Maps whose data did not change since the last published version are skipped,
+    the others are sent concurrently (MAP_MAX_WORKERS) through one Datawrapper
+    session.
+
     Parameters
     ----------
     config : dict
@@ -214,7 +262,7 @@ def now(config):
 
     if None in idStatesMap.values():
         IS_DEV = True
-        print("Generating new ids")
+        logger.info("Generating new ids")
     else:
         IS_DEV = os.getenv("IS_MAP_DEV") == "True"
 
@@ -223,95 +271,91 @@ def now(config):
     else:
         map_folder_id = 38060  # "maps-coronacidades"
 
-    dw = Datawrapper(access_token=ACCESS_TOKEN)
-
-    if IS_DEV:
-        # Create states map
-        for state_id in states:
-            config["br"]["maps"]["idStatesMap"][state_id] = Map(
-                config,
-                map_folder_id,
-                ACCESS_TOKEN,
-                basemapCMD=f"brazil-{idStateCode[state_id]}-municipalities",
-                state_id=state_id,
-            ).createMap()
-
-            # Update layout
-            Map(
-                config,
-                map_folder_id,
-                ACCESS_TOKEN,
-                basemapCMD=f"brazil-{idStateCode[state_id]}-municipalities",
-                state_id=state_id,
-            ).applyDefaultLayout(config["br"]["maps"]["idStatesMap"][state_id])
-
-            dw.publish_chart(config["br"]["maps"]["idStatesMap"][state_id])
-            print(state_id + ": " + config["br"]["maps"]["idStatesMap"][state_id])
-
-        # Create country map
-        config["br"]["maps"]["BR_ID"] = Map(
-            config,
-            map_folder_id,
-            ACCESS_TOKEN,
-            basemapCMD="brazil-states-2018",
-            state_id=None,
-        ).createMap()
-
-        # Update layout
-        Map(
-            config,
-            map_folder_id,
-            ACCESS_TOKEN,
-            basemapCMD="brazil-states-2018",
-            state_id=None,
-        ).applyDefaultLayout(config["br"]["maps"]["BR_ID"])
+    max_workers = int(os.getenv("MAP_MAX_WORKERS", 8))
+    dw = Datawrapper(access_token=ACCESS_TOKEN, pool_size=max_workers)
 
-        dw.publish_chart(config["br"]["maps"]["BR_ID"])
-        print("BR : " + config["br"]["maps"]["BR_ID"])
+    # Dados do Farol carregados uma vez e separados por estado
+    cities_data, states_data = get_map_data(config, states)
 
-    else:
-        # Update states map
-        for state_id in states:
-            Map(
-                config,
-                map_folder_id,
-                ACCESS_TOKEN,
-                basemapCMD=f"brazil-{idStateCode[state_id]}-municipalities",
-                state_id=state_id,
-            ).updateMap(config["br"]["maps"]["idStatesMap"][state_id])
-
-            dw.publish_chart(config["br"]["maps"]["idStatesMap"][state_id])
-            print(state_id + ": " + config["br"]["maps"]["idStatesMap"][state_id])
-
-        # Update country map
-        Map(
+    maps = {
+        state_id: Map(
             config,
             map_folder_id,
             ACCESS_TOKEN,
-            basemapCMD="brazil-states-2018",
-            state_id=None,
-        ).updateMap(config["br"]["maps"]["BR_ID"])
-
-        dw.publish_chart(config["br"]["maps"]["BR_ID"])
-        print("BR : " + config["br"]["maps"]["BR_ID"])
-
-    out_frame = (
-        pd.DataFrame(
-            {
-                "place_id": list(config["br"]["maps"]["idStatesMap"].keys()),
-                "map_id": list(config["br"]["maps"]["idStatesMap"].values()),
-            }
+            basemapCMD=f"brazil-{idStateCode[state_id]}-municipalities",
+            state_id=state_id,
+            data=cities_data[state_id],
+            dw=dw,
         )
-        .append(
-            pd.DataFrame({"place_id": "BR", "map_id": [config["br"]["maps"]["BR_ID"]]})
-        )
-        .reset_index(drop=True)
+        for state_id in states
+    }
+    maps["BR"] = Map(
+        config,
+        map_folder_id,
+        ACCESS_TOKEN,
+        basemapCMD="brazil-states-2018",
+        state_id=None,
+        data=states_data,
+        dw=dw,
     )
 
-    # Gens the hashes for version control
+    def create(place_id):
+        # Create map & update layout
+        map_id = maps[place_id].createMap()
+        maps[place_id].applyDefaultLayout(map_id)
+
+        dw.publish_chart(map_id)
+        logger.info("{}: {}", place_id, map_id)
+        return map_id
+
+    def update(place_id, map_id):
+        maps[place_id].updateMap(map_id)
+
+        dw.publish_chart(map_id)
+        logger.info("{}: {}", place_id, map_id)
+        return map_id
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        if IS_DEV:
+            # Create states & country maps
+            jobs = {place_id: executor.submit(create, place_id) for place_id in maps}
+
+        else:
+            # Update only the maps with new data
+            map_ids = dict(idStatesMap, BR=config["br"]["maps"]["BR_ID"])
+            published = get_published_hashes()
+
+            jobs = {
+                place_id: executor.submit(update, place_id, map_ids[place_id])
+                for place_id in maps
+                if published.get(map_ids[place_id])
+                != maps[place_id].hash(map_ids[place_id])
+            }
+            logger.info("Skipping {} unchanged maps", len(maps) - len(jobs))
+
+        for place_id, job in jobs.items():
+            if place_id == "BR":
+                config["br"]["maps"]["BR_ID"] = job.result()
+            else:
+                config["br"]["maps"]["idStatesMap"][place_id] = job.result()
+
+    out_frame = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "place_id": list(config["br"]["maps"]["idStatesMap"].keys()),
+                    "map_id": list(config["br"]["maps"]["idStatesMap"].values()),
+                }
+            ),
+            pd.DataFrame({"place_id": "BR", "map_id": [config["br"]["maps"]["BR_ID"]]}),
+        ]
+    ).reset_index(drop=True)
+
+    # Gens the hashes for version control: same data, same hash
     out_frame["hashes"] = [
-        "".join(random.choice("0123456789ABCDEF") for i in range(16))
-        for i in range(out_frame.shape[0])
+        maps[place_id].hash(map_id)
+        for place_id, map_id in zip(out_frame["place_id"], out_frame["map_id"])
     ]
     return out_frame
 
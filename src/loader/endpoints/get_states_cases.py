@@ -47,15 +47,13 @@ def now(config):
     logger.info("FINISH DATA TREATMENT")
 
     # Gera métricas de média móvel e tendência
-    groups = df.groupby("state_num_id", as_index=False)
-    df = groups.apply(
-        lambda x: get_rolling_indicators(x, config, cols=["daily_cases", "new_deaths"])
+    df = get_rolling_indicators(
+        df, config, place_id="state_num_id", cols=["daily_cases", "new_deaths"]
     )
-    df = df.reset_index(drop=True)
     logger.info("FINISH DATA GROW CALCULATION")
 
     # Gera dados de taxa de notificacao e casos ativos
-    df = _get_notification_rate(df, place_id="state_num_id")
+    df = _get_notification_rate(df, config, place_id="state_num_id")
     logger.info("FINISH NOTIFICATION RATE CALCULATION")
 
     # Calcula casos ativos
@@ -1,30 +1,87 @@
-import pandas as pd
+import threading
 
-from utils import build_file_path, get_endpoints
+from utils import read_local, get_endpoints
+
+# Resultados ja carregados nessa rodada do loader, por modulo e argumentos
+_cache = dict()
+_cache_lock = threading.Lock()
+_key_locks = dict()
+
+
+def _freeze(value):
+    """Turns the arguments of `now()` (usually the config dict) into a hashable key."""
+
+    if isinstance(value, dict):
+        return tuple(sorted(((repr(k), _freeze(v)) for k, v in value.items())))
+
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+
+    return repr(value)
+
+
+def _copy(data):
+    # Cada consumidor recebe sua copia: os endpoints alteram os dados recebidos
+    return data.copy() if hasattr(data, "copy") else data
+
+
+def invalidate(module):
+    """Drops every cached result of an endpoint module."""
+
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == module]:
+            del _cache[key]
 
 
 def allow_local(func):
+    """Loads the endpoint output written by the loader instead of running it.
+
+    The first call in a run reads the local file (preferring its typed Feather
+    copy, see `utils.read_local`) or runs the endpoint when there is no file yet,
+    and the result is kept in memory for the next calls with the same arguments,
+    which get a copy of it. Calling with `force=True` always runs
+    the endpoint and invalidates its cached results, so the next calls read the
+    new output once it is written.
+    """
+
     def wrapper(*args, **kwargs):
 
+        module = func.__module__.split(".")[1]
+
         if kwargs.get("force"):
 
             kwargs.pop("force")
 
+            invalidate(module)
+
             return func(*args, **kwargs)
 
-        else:
+        kwargs.pop("force", None)
 
-            module = func.__module__.split(".")[1]
+        key = (module, _freeze(args), _freeze(kwargs))
+
+        with _cache_lock:
+            lock = _key_locks.setdefault(key, threading.Lock())
+
+        # Evita que endpoints rodando em paralelo carreguem o mesmo dado duas vezes
+        with lock:
+
+            with _cache_lock:
+                if key in _cache:
+                    return _copy(_cache[key])
 
             endpoint = [l for l in get_endpoints() if module in l.values()][0]
 
             try:
-                return pd.read_csv(build_file_path(endpoint))
+                data = read_local(endpoint)
 
             except FileNotFoundError:
 
-                kwargs.pop("force", None)
+                data = func(*args, **kwargs)
+
+            with _cache_lock:
+                _cache[key] = data
 
-                return func(*args, **kwargs)
+            return _copy(data)
 
     return wrapper
@@ -1,10 +1,15 @@
 import json
+import os
+import shutil
+import tempfile
+from urllib.error import HTTPError
 from urllib.parse import urljoin
 from urllib.request import Request, urlopen
 
 class BrasilIO:
 
     base_url = "https://api.brasil.io/v1/"
+    download_url = "https://data.brasil.io/dataset/"
 
     def __init__(self, user_agent=None, auth_token=None):
         """
@@ -54,8 +59,55 @@ class BrasilIO:
             url = next_page
             finished = next_page is None
 
-    def download(self, dataset, table_name):
-        url = f"https://data.brasil.io/dataset/{dataset}/{table_name}.csv.gz"
-        request = Request(url, headers=self.headers(api=False))
+    def download(self, dataset, table_name, headers=None):
+        url = urljoin(self.download_url, f"{dataset}/{table_name}.csv.gz")
+        request = Request(url, headers={**self.headers(api=False), **(headers or {})})
         response = urlopen(request)
         return response
+
+    def download_if_modified(self, dataset, table_name, path):
+        """
+        Baixa o arquivo completo para `path` somente se ele mudou no servidor desde
+        o último download (cabeçalhos ETag/Last-Modified guardados em `path`.json).
+        Sem mudança, custa uma requisição respondida com 304.
+
+        Retorna True se o arquivo foi baixado, False se a cópia local foi mantida.
+        """
+        meta_path = path + ".json"
+
+        headers = {}
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.download(dataset, table_name, headers=headers)
+        except HTTPError as e:
+            if e.code == 304:
+                return False
+            raise
+
+        # Escreve em arquivo temporário para não deixar uma cópia truncada
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        with open(meta_path, "w") as f:
+            json.dump(
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+                f,
+            )
+
+        return True
@@ -0,0 +1,86 @@
+import os
+from urllib.parse import urljoin
+
+import requests
+
+
+def _merge(current, new):
+    # Atualiza os metadados aninhados sem apagar as chaves que nao foram passadas
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(current.get(key), dict):
+            _merge(current[key], value)
+        else:
+            current[key] = value
+    return current
+
+
+class Datawrapper:
+    """
+    Cliente da API v3 do Datawrapper com as chamadas usadas pelos mapas.
+
+    Todas as chamadas passam pela mesma sessao (conexoes reaproveitadas), que
+    pode ser usada por varias threads ao mesmo tempo. O endereco da API vem de
+    DATAWRAPPER_API_URL, para testar com um servidor local.
+    """
+
+    def __init__(self, access_token=None, base_url=None, pool_size=10):
+        self.base_url = base_url or os.getenv(
+            "DATAWRAPPER_API_URL", "https://api.datawrapper.de/v3/"
+        )
+        if not self.base_url.endswith("/"):
+            self.base_url += "/"
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(
+            method, urljoin(self.base_url, path), timeout=60, **kwargs
+        )
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    def create_chart(self, title, chart_type, data=None, folder_id=None):
+        chart = {"title": title, "type": chart_type}
+        if folder_id:
+            chart["folderId"] = folder_id
+
+        chart_info = self._request("POST", "charts", json=chart)
+
+        if data is not None:
+            self.add_data(chart_info["id"], data)
+
+        return chart_info
+
+    def add_data(self, chart_id, data):
+        self._request(
+            "PUT",
+            f"charts/{chart_id}/data",
+            data=data.to_csv(index=False).encode("utf-8"),
+            headers={"Content-Type": "text/csv"},
+        )
+
+    def update_metadata(self, chart_id, properties):
+        metadata = self._request("GET", f"charts/{chart_id}").get("metadata", {})
+
+        self._request(
+            "PATCH",
+            f"charts/{chart_id}",
+            json={"metadata": _merge(metadata, properties)},
+        )
+
+    def update_chart(self, chart_id, title="", theme="", chart_type=""):
+        # Como no pacote datawrapper, campos vazios nao sao alterados
+        chart = {"title": title, "theme": theme, "type": chart_type}
+        chart = {key: value for key, value in chart.items() if value}
+
+        if chart:
+            self._request("PATCH", f"charts/{chart_id}", json=chart)
+
+    def publish_chart(self, chart_id):
+        self._request("POST", f"charts/{chart_id}/publish")
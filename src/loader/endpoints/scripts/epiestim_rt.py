@@ -1,20 +1,9 @@
-# CITIES RT
+# Rt de Cori et al. (EpiEstim::estimate_R, method="parametric_si") em NumPy,
+# calculado para todos os lugares de uma vez
 
+import numpy as np
 import pandas as pd
-import datetime as dt
-
-from endpoints.helpers import allow_local
-from endpoints import get_cities_cases
-import rpy2.robjects as ro
-from rpy2.robjects.conversion import localconverter
-
-from rpy2.robjects import pandas2ri
-
-pandas2ri.activate()
-
-from rpy2.robjects.packages import importr
-
-eps = importr("EpiEstim")
+from scipy import stats as sps
 
 # TODO: passar para config
 dic = {
@@ -23,48 +12,120 @@ dic = {
         "Quantile.0.05(R)": "Rt_low_95",
         "Quantile.0.95(R)": "Rt_high_95",
     },
-    "episestim_params": {"mean_si": 4.7, "std_si": 2.9, "mean_prior": 3},
+    "episestim_params": {
+        "mean_si": 4.7,
+        "std_si": 2.9,
+        "mean_prior": 3,
+        "std_prior": 5,
+        "window": 7,
+    },
 }
 
 
-def run_epiestim(group):
-
-    # Remove valores nulos
-    group = group.dropna(subset=["I"])
-    # Filtra > 15 dias para cálculo
-    if len(group) < 15:
-        return
-    # Filtra séries não negativas
-    if any(group["I"] < 0):
-        return
-
-    # Converte para série em R
-    with localconverter(ro.default_converter + pandas2ri.converter):
-        infected_series = ro.conversion.py2rpy(group[["I"]])
-
-    # Calcula Rt
-    rt = dict(
-        eps.estimate_R(
-            infected_series,
-            method="parametric_si",
-            config=eps.make_config(
-                mean_si=dic["episestim_params"]["mean_si"],
-                std_si=dic["episestim_params"]["std_si"],
-                mean_prior=dic["episestim_params"]["mean_prior"],
-            ),
-        ).items()
-    )["R"]
+def discr_si(k, mu, sigma):
+    """
+    Discretised gamma serial interval, as EpiEstim's `discr_si`
 
-    # Recupera coluna de datas - começa depois de 7 dias
-    rt = (
-        rt.rename(columns=dic["replace"])[dic["replace"].values()]
-        .reset_index(drop=True)
-        .join(group.iloc[7:]["dates"].reset_index(drop=True))
+    Arguments
+    ----------
+    k: days of the serial interval distribution
+    mu: mean of the serial interval
+    sigma: standard deviation of the serial interval
+    Returns
+    ----------
+    w: probability of each day k
+    """
+
+    a = ((mu - 1) / sigma) ** 2
+    b = sigma ** 2 / (mu - 1)
+
+    def cdf_gamma(k, a, b):
+        return sps.gamma.cdf(k, a, scale=b)
+
+    w = (
+        k * cdf_gamma(k, a, b)
+        + (k - 2) * cdf_gamma(k - 2, a, b)
+        - 2 * (k - 1) * cdf_gamma(k - 1, a, b)
     )
-    return rt
+    w_next = (
+        2 * cdf_gamma(k - 1, a + 1, b)
+        - cdf_gamma(k - 2, a + 1, b)
+        - cdf_gamma(k, a + 1, b)
+    )
+    w += a * b * w_next
+    return np.maximum(0, w)
+
+
+def estimate_r(incid, lengths, params=dic["episestim_params"]):
+    """
+    Estimates Rt on sliding windows for many places at once
+
+    Arguments
+    ----------
+    incid: array (days x places) of incidence, each place starting on the first
+           row and padded after its last day
+    lengths: number of days of each place
+    params: serial interval, prior and window parameters
+    Returns
+    ----------
+    estimates: array (days x places x 3) with posterior mean, 5% and 95% quantiles
+               of the window ending on each day, NaN where there is no window
+    See also
+    ----------
+    Same defaults as `estimate_R`: windows start on the second day and the
+    gamma prior has mean `mean_prior` and std `std_prior`.
+    """
+
+    n_days, n_places = incid.shape
+    window = params["window"]
+
+    # Serial interval and its mean, as `estimate_R` truncates it to the series
+    w = discr_si(np.arange(n_days), params["mean_si"], params["std_si"])
+    mean_si = np.sum(w * np.arange(n_days))
+
+    # Overall infectivity: lambda_t = sum_s w_s I_{t-s}
+    padded = np.where(np.arange(n_days)[:, None] < lengths[None, :], incid, 0.0)
+    infectivity = np.zeros((n_days, n_places))
+    for s in range(1, n_days):
+        if w[s] == 0 and w[s:].sum() == 0:
+            break
+        infectivity[s:] += w[s] * padded[:-s]
+
+    # Sums over the window ending on each day (the first day is left out)
+    sum_incid = np.full((n_days, n_places), np.nan)
+    sum_infectivity = np.full((n_days, n_places), np.nan)
+    sum_incid[window:] = sum(padded[window - j : n_days - j] for j in range(window))
+    sum_infectivity[window:] = sum(
+        infectivity[window - j : n_days - j] for j in range(window)
+    )
+
+    t_end = np.arange(n_days)[:, None]
+    valid = (t_end < lengths[None, :]) & (t_end + 1 > mean_si)
+    valid &= np.isfinite(sum_incid)
+
+    # Gamma posterior
+    a_prior = (params["mean_prior"] / params["std_prior"]) ** 2
+    b_prior = params["std_prior"] ** 2 / params["mean_prior"]
+
+    a = a_prior + sum_incid[valid]
+    b = 1 / (1 / b_prior + sum_infectivity[valid])
+
+    estimates = np.full((n_days, n_places, 3), np.nan)
+    estimates[valid] = np.stack(
+        [a * b, sps.gamma.ppf(0.05, a, scale=b), sps.gamma.ppf(0.95, a, scale=b)],
+        axis=1,
+    )
+    return estimates
 
 
 def get_rt(df, place_id):
+    """
+    Rt of each place with the Cori method, from the cases table
+
+    Returns
+    ----------
+    rt: Rt_most_likely, Rt_low_95 and Rt_high_95 by place and date
+    """
 
     # Agrega e filtra a série de casos: > 100 casos confirmados
     df_cases = (
@@ -79,117 +140,35 @@ def get_rt(df, place_id):
     )
 
     # Calcula Rt com mavg de casos ativos
-    rt = (
+    df_cases = (
         df_cases.groupby(place_id)
         .rolling(7, min_periods=7, on="dates")["daily_cases"]
         .mean()
         .reset_index()
         .rename(columns={"daily_cases": "I"})
-        .groupby(place_id)
-        .apply(run_epiestim)
-        .reset_index(0)
-        .rename(columns={"dates": "last_updated"})
-    )
-
-    # Calcula crescimento
-    rt = get_cities_cases.get_mavg_indicators(
-        rt, "Rt_most_likely", place_id, weighted=False
+        .dropna(subset=["I"])
     )
-    return rt
-
-
-@allow_local
-def now(config=None):
-    return get_rt(get_cities_cases.now(), place_id="city_id")
 
+    # Filtra > 15 dias para cálculo e séries não negativas
+    groups = df_cases.groupby(place_id)["I"]
+    keep = (groups.transform("size") >= 15) & (groups.transform("min") >= 0)
+    df_cases = df_cases[keep]
 
-TESTS = {
-    "data is not pd.DataFrame": lambda df: isinstance(df, pd.DataFrame),
-    "dataframe has null data": lambda df: all(
-        df[["Rt_most_likely", "Rt_high_95", "Rt_low_95"]].isnull().any() == False
-    ),
-    "rt most likely outside confidence interval": lambda df: len(
-        df[
-            (df["Rt_most_likely"] <= df["Rt_high_95"])
-            & (df["Rt_most_likely"] >= df["Rt_low_95"])
-        ]
-    )
-    == len(df),
-    # "less than 14 days": lambda df: all(
-    #     df.groupby("city_id")["last_updated"].count() > 14
-    # )
-    # == True,
-}
-
+    # Cada lugar numa coluna, a partir da primeira linha
+    pos = df_cases.groupby(place_id).cumcount().values
+    places, col = np.unique(df_cases[place_id].values, return_inverse=True)
+    lengths = np.bincount(col, minlength=len(places))
 
-# REGION
+    incid = np.zeros((lengths.max() if len(places) else 0, len(places)))
+    incid[pos, col] = df_cases["I"].values
 
-import pandas as pd
-import numpy as np
-from endpoints.helpers import allow_local
-from endpoints import get_health_region_cases, get_cities_rt
-
-
-@allow_local
-def now(config=None):
-    return get_cities_rt.get_rt(
-        get_health_region_cases.now(), place_id="health_region_id"
-    )
+    estimates = estimate_r(incid, lengths)
 
+    # Recupera coluna de datas - começa depois de 7 dias
+    found = ~np.isnan(estimates[pos, col, 0])
+    names = list(dic["replace"].values())
+    rt = df_cases.loc[found, [place_id, "dates"]].reset_index(drop=True)
+    for i, name in enumerate(names):
+        rt[name] = estimates[pos[found], col[found], i]
 
-# TODO: review tests
-TESTS = {
-    "data is not pd.DataFrame": lambda df: isinstance(df, pd.DataFrame),
-    "dataframe has null data": lambda df: all(
-        df[["Rt_most_likely", "Rt_high_95", "Rt_low_95"]].isnull().any() == False
-    ),
-    "rt most likely outside confidence interval": lambda df: len(
-        df[
-            (df["Rt_most_likely"] <= df["Rt_high_95"])
-            & (df["Rt_most_likely"] >= df["Rt_low_95"])
-        ]
-    )
-    == len(df),
-    # "region has rt with less than 14 days": lambda df: all(
-    #     df.groupby("health_region_id")["last_updated"].count() > 14
-    # )
-    # == True,
-}
-
-
-# STATES
-
-import pandas as pd
-import numpy as np
-from endpoints.helpers import allow_local
-from endpoints import get_states_cases, get_cities_rt
-
-
-@allow_local
-def now(config=None):
-    # TODO: mudar para get_[cities/region/states]_cases quando tiver as tabelas
-    return get_cities_rt.get_rt(get_states_cases.now(), place_id="state_num_id")
-
-
-# TODO: review tests
-TESTS = {
-    "data is not pd.DataFrame": lambda df: isinstance(df, pd.DataFrame),
-    "dataframe has null data": lambda df: all(
-        df[["Rt_most_likely", "Rt_high_95", "Rt_low_95"]].isnull().any() == False
-    ),
-    # "not all 27 states with updated rt": lambda df: len(
-    #     df.drop_duplicates("state_num_id", keep="last")
-    # )
-    # == 27,
-    "rt most likely outside confidence interval": lambda df: len(
-        df[
-            (df["Rt_most_likely"] <= df["Rt_high_95"])
-            & (df["Rt_most_likely"] >= df["Rt_low_95"])
-        ]
-    )
-    == len(df),
-    # "state has rt with less than 14 days": lambda df: all(
-    #     df.groupby("state_num_id")["last_updated"].count() > 14
-    # )
-    # == True,
-}
+    return rt.rename(columns={"dates": "last_updated"})
@@ -5,11 +5,17 @@
 # ==============================================
 
 import pandas as pd
+import numpy as np
 from scipy.stats import nbinom
-import scipy
 import datetime
+import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
+from logger import logger
+from utils import build_cache_path
+
 # Params
 ifr_by_age = {
     "from_0_to_9": 0.00002,
@@ -26,6 +32,10 @@ ifr_by_age = {
 simulation_params = {
     "n": 10000,  # n
     "odd": 99,  # odd
+    "seed": 2020,  # semente do gerador, para resultados reproduziveis
+    "max_draws": 2000000,  # amostras sorteadas de uma vez (memoria)
+    "cache_size": 200000,  # estimativas guardadas entre rodadas
+    "key_decimals": 6,  # casas de k e p que diferenciam uma estimativa
 }
 
 agg_params = {
@@ -35,22 +45,166 @@ agg_params = {
 
 
 # Funcs
-def bin_neg_simulation(k, p, n=10000, odd=99):
+def _trimmed_mean_analytic(k, p, lower):
+    """
+    Media exata da binomial negativa acima do percentil `lower`, sem sortear:
+    E[X | X >= q] = mu * P(Y >= q - 1) / P(X >= q), com Y ~ BN(k + 1, p)
+    """
+    q = nbinom.ppf(lower / 100, k, p)
+    mean = k * (1 - p) / p
+    return mean * nbinom.sf(q - 2, k + 1, p) / nbinom.sf(q - 1, k, p)
+
+
+def _trimmed_mean_simulation(k, p, n, odd, seed):
     """
-    Funcao que retorna o valor de uma distribuicao binomial negativa frente aos parametros dados
+    Media aparada de n amostras para cada par (k, p). Cada par tem seu proprio
+    gerador, semeado por `seed` e pelo par, entao a estimativa nao depende das
+    outras linhas nem da rodada.
     """
-    if k <= 0:
-        return None
-    a = 100 - odd
-    b = odd + (100 - odd)
-    r = nbinom.rvs(k, p, size=n)
-    return int(
-        scipy.stats.tmean(
-            r,
-            (scipy.stats.scoreatpercentile(r, a), scipy.stats.scoreatpercentile(r, b)),
+    means = np.empty(len(k))
+
+    rows = max(1, simulation_params["max_draws"] // n)
+    for start in range(0, len(k), rows):
+        chunk = slice(start, start + rows)
+        r = np.stack(
+            [
+                np.random.default_rng(
+                    [seed] + np.array([a, b]).view(np.uint64).tolist()
+                ).negative_binomial(a, b, size=n)
+                for a, b in zip(k[chunk], p[chunk])
+            ]
         )
+        low, high = np.percentile(r, [100 - odd, odd + (100 - odd)], axis=1)
+        keep = (r >= low[:, None]) & (r <= high[:, None])
+        means[chunk] = (r * keep).sum(axis=1) / keep.sum(axis=1)
+
+    return means
+
+
+# Estimativas ja calculadas por (method, n, odd, seed, k, p), das mais antigas
+# para as mais usadas, e parametros ja lidos do disco
+_estimates = OrderedDict()
+_estimates_lock = threading.Lock()
+_loaded = set()
+
+
+def _estimates_path(params):
+    return build_cache_path(
+        "notification_rate", "estimated_cases_{}_{}_{}_{}.feather".format(*params)
+    )
+
+
+def _load_estimates(params):
+
+    if params in _loaded:
+        return
+    _loaded.add(params)
+
+    try:
+        saved = pd.read_feather(_estimates_path(params))
+    except (FileNotFoundError, OSError, ValueError):
+        return
+
+    for k, p, estimated in saved[["k", "p", "estimated"]].values:
+        _estimates[params + (k, p)] = estimated
+
+
+def _save_estimates(params):
+
+    saved = pd.DataFrame(
+        [key[-2:] + (value,) for key, value in _estimates.items() if key[:4] == params],
+        columns=["k", "p", "estimated"],
+    )
+
+    path = _estimates_path(params)
+    try:
+        saved.to_feather(path + ".tmp")
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logger.warning("NOTIFICATION RATE ESTIMATES NOT SAVED: {}", e)
+
+
+def bin_neg_simulation(
+    k,
+    p,
+    n=simulation_params["n"],
+    odd=simulation_params["odd"],
+    method="simulation",
+    seed=simulation_params["seed"],
+):
+    """
+    Funcao que retorna o valor de uma distribuicao binomial negativa frente aos parametros dados:
+    a media aparada entre os percentis (100 - odd) e 100 de n amostras.
+
+    As estimativas ficam guardadas por par (k, p), arredondados a `key_decimals`
+    casas, em memoria e em disco entre as rodadas (as `cache_size` mais usadas):
+    so os pares novos sao calculados.
+
+    Parameters
+    ----------
+    k: array
+        Parametro de sucessos de cada linha (mortes). Linhas com k <= 0 retornam NaN
+    p: array
+        Probabilidade de sucesso de cada linha (mortalidade esperada)
+    method: string
+        "simulation" sorteia as n amostras dos pares novos, com um gerador por par
+        semeado por `seed`; "analytic" calcula a media aparada da distribuicao, sem
+        sortear (percentil inferior pela ppf)
+    """
+    if method not in ("simulation", "analytic"):
+        raise ValueError(f"Unknown notification rate method: {method}")
+
+    k, p = np.broadcast_arrays(np.asarray(k, dtype=float), np.asarray(p, dtype=float))
+
+    # k e media movel de mortes: o mesmo valor sai com ruido de float (ex.
+    # 3.4666666666666663 e 3.466666666666667). Diferencas tao pequenas nao
+    # mudam a media de n amostras, entao k e p sao arredondados antes de
+    # procurar, calcular e guardar a estimativa
+    k = np.round(k, simulation_params["key_decimals"])
+    p = np.round(p, simulation_params["key_decimals"])
+    estimated = np.full(k.shape, np.nan)
+
+    valid = (k > 0) & (p > 0) & (p <= 1)
+    pairs = list(zip(k[valid].tolist(), p[valid].tolist()))
+    params = (method, n, odd, seed)
+
+    with _estimates_lock:
+        _load_estimates(params)
+
+        found = dict()
+        for pair in set(pairs):
+            if params + pair in _estimates:
+                _estimates.move_to_end(params + pair)
+                found[pair] = _estimates[params + pair]
+
+    missing = sorted(set(pairs) - found.keys())
+    logger.debug(
+        "NOTIFICATION RATE ESTIMATES: {} CACHED, {} NEW", len(found), len(missing)
     )
 
+    if missing:
+        new_k, new_p = np.array(missing).T
+
+        if method == "analytic":
+            values = _trimmed_mean_analytic(new_k, new_p, 100 - odd)
+        else:
+            values = _trimmed_mean_simulation(new_k, new_p, n, odd, seed)
+
+        found.update(zip(missing, values.tolist()))
+
+        with _estimates_lock:
+            for pair, value in zip(missing, values.tolist()):
+                _estimates[params + pair] = value
+
+            while len(_estimates) > simulation_params["cache_size"]:
+                _estimates.popitem(last=False)
+
+            _save_estimates(params)
+
+    estimated[valid] = [found[pair] for pair in pairs]
+
+    return np.floor(estimated)
+
 
 def get_population(place_id):
     pop = pd.read_csv(
@@ -68,7 +222,7 @@ def get_population(place_id):
     )  # drop other place level
 
 
-def now(df, place_id="health_region_id", is_acum=False):
+def now(df, place_id="health_region_id", is_acum=False, method="simulation"):
     """
     Calcula a taxa de notificação de dados da regional/estado com base no algoritmo desenvolvido pelo Instituto Serrapilheira.
 
@@ -80,6 +234,8 @@ def now(df, place_id="health_region_id", is_acum=False):
         Nível de agregação populacional (regional = health_region_id, estado = state_num_id).  Default = health_region_id.
     is_acum: boolean
         Indica se os casos e mortes considerados são acumulados (False) ou novos diários (True). Default = False
+    method: string
+        Estimativa de casos por simulação ("simulation") ou pela média exata da distribuição ("analytic"), ver `bin_neg_simulation`. Default = simulation
     
     """
     # Get region mortality prob weighted by age
@@ -131,8 +287,10 @@ def now(df, place_id="health_region_id", is_acum=False):
     )
     # Estimate cases on delayed date
     df_estimation = df[[place_id, "date_infected", deaths, "expected_mortality"]]
-    df_estimation["estimated_cases"] = df_estimation.apply(
-        lambda row: bin_neg_simulation(row[deaths], row["expected_mortality"]), axis=1,
+    df_estimation["estimated_cases"] = bin_neg_simulation(
+        df_estimation[deaths].values,
+        df_estimation["expected_mortality"].values,
+        method=method,
     )
 
     # Join notification rate on delayed date
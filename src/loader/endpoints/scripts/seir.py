@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 import yaml
-from scipy.integrate import odeint
+from scipy.integrate import odeint, LSODA
 
 
 def prepare_states(population_params, place_specific_params, disease_params):
@@ -249,3 +249,264 @@ def entrypoint(
     result.index.name = "dias"
 
     return result
+
+
+compartments = ["S", "E", "I1", "I2", "I3", "R", "D"]
+rate_names = [
+    "beta1",
+    "beta2",
+    "beta3",
+    "sigma",
+    "gamma1",
+    "p1",
+    "gamma2",
+    "p2",
+    "gamma3",
+    "mu",
+]
+
+
+def SEIR_batch(y, t, rates):
+    """
+    The SEIR model differential equations for many places at once.
+
+    Params
+    --------
+    y: np.array
+         Flattened (places x compartments) population, compartments in the order
+         of `compartments`
+
+    rates: np.array
+           (rates x places) transmission, progression, recovery and death rates,
+           in the order of `rate_names`
+
+    Return
+    -------
+    np.array
+            Flattened derivatives, same layout as `y`
+    """
+
+    S, E, I1, I2, I3, R, D = y.reshape(-1, 7).T
+    beta1, beta2, beta3, sigma, gamma1, p1, gamma2, p2, gamma3, mu = rates
+
+    exposition_rate = beta1 * I1 + beta2 * I2 + beta3 * I3
+
+    return np.stack(
+        [
+            -exposition_rate * S,
+            exposition_rate * S - sigma * E,
+            sigma * E - (gamma1 + p1) * I1,
+            p1 * I1 - (gamma2 + p2) * I2,
+            p2 * I2 - (gamma3 + mu) * I3,
+            gamma1 * I1 + gamma2 * I2 + gamma3 * I3,
+            mu * I3,
+        ],
+        axis=1,
+    ).ravel()
+
+
+def SEIR_batch_jacobian(y, t, rates):
+    """
+    Analytic Jacobian of `SEIR_batch` in `odeint` banded format.
+
+    Each place only depends on its own 7 compartments, so the Jacobian is
+    block diagonal and fits in 6 bands below and above the diagonal:
+    `jac[i - j + 6, j]` is the derivative of equation i by compartment j.
+    """
+
+    S, E, I1, I2, I3, R, D = y.reshape(-1, 7).T
+    beta1, beta2, beta3, sigma, gamma1, p1, gamma2, p2, gamma3, mu = rates
+
+    exposition_rate = beta1 * I1 + beta2 * I2 + beta3 * I3
+
+    # Derivative of equation i by compartment j, for each place
+    J = np.zeros((len(S), 7, 7))
+    J[:, 0, 0] = -exposition_rate
+    J[:, 0, 2], J[:, 0, 3], J[:, 0, 4] = -beta1 * S, -beta2 * S, -beta3 * S
+    J[:, 1, 0] = exposition_rate
+    J[:, 1, 1] = -sigma
+    J[:, 1, 2], J[:, 1, 3], J[:, 1, 4] = beta1 * S, beta2 * S, beta3 * S
+    J[:, 2, 1], J[:, 2, 2] = sigma, -(gamma1 + p1)
+    J[:, 3, 2], J[:, 3, 3] = p1, -(gamma2 + p2)
+    J[:, 4, 3], J[:, 4, 4] = p2, -(gamma3 + mu)
+    J[:, 5, 2], J[:, 5, 3], J[:, 5, 4] = gamma1, gamma2, gamma3
+    J[:, 6, 4] = mu
+
+    bands = np.zeros((13, len(S), 7))
+    for i in range(7):
+        for j in range(7):
+            bands[i - j + 6, :, j] = J[:, i, j]
+
+    return bands.reshape(13, -1)
+
+
+def entrypoint_batch(
+    population_params,
+    place_specific_params,
+    disease_params,
+    R0,
+    n_days,
+    initial=False,
+):
+    """
+    Runs the model for many places and scenarios in one `odeint` call.
+
+    Params
+    --------
+    population_params: dict
+         Population parameters, one array entry per place (same as `entrypoint`)
+
+    place_specific_params: dict
+        Parameters for specific places, one array entry per place
+
+    disease_params: dict
+        Parameters of model dynamic (transmission, progression, recovery and death rates)
+
+    R0: np.array
+        Reproduction rate of each place
+
+    n_days: int
+        Days to run
+
+    Return
+    -------
+    np.array
+            (places x days x compartments) evolution of population parameters,
+            compartments in the order of `compartments`
+    """
+
+    y0, args = _prepare_batch(
+        population_params, place_specific_params, disease_params, R0, initial
+    )
+
+    result = odeint(
+        SEIR_batch,
+        y0.ravel(),
+        np.linspace(0, n_days, n_days + 1),
+        args=(args,),
+        Dfun=SEIR_batch_jacobian,
+        ml=6,
+        mu=6,
+    )
+
+    return result.reshape(n_days + 1, -1, 7).transpose(1, 0, 2)
+
+
+def _prepare_batch(
+    population_params, place_specific_params, disease_params, R0, initial
+):
+    """
+    Initial (places x compartments) states and (rates x places) rates of a batch
+    """
+
+    population_params = {
+        k: np.asarray(v, dtype=float) for k, v in population_params.items()
+    }
+    place_specific_params = {
+        k: np.asarray(v, dtype=float) for k, v in place_specific_params.items()
+    }
+    R0 = np.asarray(R0, dtype=float)
+
+    if initial:  # Get I1, I2, I3 & E
+        states = prepare_states(
+            population_params, place_specific_params, disease_params
+        )
+    else:
+        states = population_params
+
+    params = prepare_disease_params(
+        population_params, place_specific_params, disease_params, R0
+    )
+
+    y0 = np.stack([np.broadcast_to(states[c], R0.shape) for c in compartments], axis=1)
+    args = np.stack([np.broadcast_to(params[r], R0.shape) for r in rate_names])
+
+    return y0, args
+
+
+def crossing_times_batch(
+    population_params,
+    place_specific_params,
+    disease_params,
+    R0,
+    thresholds,
+    n_days,
+    initial=False,
+):
+    """
+    Runs the model for many places and scenarios until each compartment in
+    `thresholds` is above its threshold in every place, or until `n_days`.
+
+    The solver is stepped without keeping the trajectory: after each step, the
+    places that crossed a threshold get the crossing time by bisection on the
+    step's interpolant.
+
+    Params
+    --------
+    thresholds: dict
+        Threshold of each place by compartment, e.g. {"I2": n_beds, "I3": n_icu_beds}
+
+    (others as in `entrypoint_batch`)
+
+    Return
+    -------
+    dict
+        Fractional day of the first crossing of each place by compartment,
+        0 if already above at the start and NaN if not crossed until `n_days`
+    """
+
+    y0, args = _prepare_batch(
+        population_params, place_specific_params, disease_params, R0, initial
+    )
+    n_places = len(y0)
+
+    index = {col: compartments.index(col) for col in thresholds}
+    levels = {
+        col: np.broadcast_to(np.asarray(v, dtype=float), (n_places,))
+        for col, v in thresholds.items()
+    }
+    times = {
+        col: np.where(y0[:, index[col]] > levels[col], 0.0, np.nan)
+        for col in thresholds
+    }
+
+    solver = LSODA(
+        lambda t, y: SEIR_batch(y, t, args),
+        0,
+        y0.ravel(),
+        n_days,
+        jac=lambda t, y: SEIR_batch_jacobian(y, t, args),
+        lband=6,
+        uband=6,
+        rtol=1.49012e-8,  # same tolerances as odeint
+        atol=1.49012e-8,
+    )
+
+    while solver.status == "running" and any(np.isnan(t).any() for t in times.values()):
+        t_old = solver.t
+        solver.step()
+
+        y = solver.y.reshape(-1, 7)
+        for col in thresholds:
+            places = np.flatnonzero(
+                np.isnan(times[col]) & (y[:, index[col]] > levels[col])
+            )
+            if len(places) == 0:
+                continue
+
+            # Bisection of each place's crossing inside the step
+            dense = solver.dense_output()
+            rows = places * 7 + index[col]
+            low = np.full(len(places), t_old)
+            high = np.full(len(places), solver.t)
+            for _ in range(40):
+                mid = (low + high) / 2
+                above = dense(mid)[rows, np.arange(len(places))] > levels[col][places]
+                low, high = np.where(above, low, mid), np.where(above, mid, high)
+
+            times[col][places] = high
+
+    if solver.status == "failed":
+        raise RuntimeError(solver.message)
+
+    return times
@@ -4,7 +4,12 @@ import yaml
 from scipy.integrate import odeint
 import sys
 
-from endpoints.scripts.seir import entrypoint
+from endpoints.scripts.seir import (
+    entrypoint,
+    entrypoint_batch,
+    crossing_times_batch,
+    compartments,
+)
 import datetime as dt
 
 
@@ -55,5 +60,75 @@ def run_simulation(params, config):
     return dday
 
 
+def get_dday_batch(results, col, resource_number):
+    """
+    Same as `get_dday` for the (places x days x compartments) output of
+    `entrypoint_batch`: first day (starting on 1) above the resource, -1 if none
+    """
+
+    above = (
+        results[:, :, compartments.index(col)] > np.asarray(resource_number)[:, None]
+    )
+    return np.where(above.any(axis=1), above.argmax(axis=1) + 1, -1)
+
+
+def run_simulation_batch(params, config, events=False):
+    """
+    Same as `run_simulation` for many places: `params` has one array entry per
+    place, and both scenarios of every place are integrated in one call.
+
+    With `events=True` the integration stops as soon as every place crossed
+    both the beds and ICU beds thresholds (see `seir.crossing_times_batch`),
+    and D-days are fractional: crossing time + 1, so 1 if already above at
+    the start and -1 if not crossed in 90 days.
+    """
+
+    n_places = len(params["R0"]["best"])
+    scenarios = ["worst", "best"]
+
+    def _repeat(values):
+        return np.tile(np.asarray(values, dtype=float), len(scenarios))
+
+    batch = dict(
+        population_params={
+            k: _repeat(v) for k, v in params["population_params"].items()
+        },
+        place_specific_params={
+            k: _repeat(v) for k, v in params["place_specific_params"].items()
+        },
+        disease_params=config["br"]["seir_parameters"],
+        R0=np.concatenate([params["R0"][bound] for bound in scenarios]),
+        n_days=90,
+        initial=True,
+    )
+    resources = {"beds": ("I2", "n_beds"), "icu_beds": ("I3", "n_icu_beds")}
+
+    if events:
+        times = crossing_times_batch(
+            thresholds={
+                col: _repeat(params[number]) for col, number in resources.values()
+            },
+            **batch,
+        )
+
+    else:
+        results = entrypoint_batch(**batch)
+
+    dday = {resource: dict() for resource in resources}
+    for i, bound in enumerate(scenarios):
+        scenario = slice(i * n_places, (i + 1) * n_places)
+
+        for resource, (col, number) in resources.items():
+            if events:
+                t = times[col][scenario]
+                dday[resource][bound] = np.where(np.isnan(t), -1, t + 1)
+            else:
+                dday[resource][bound] = get_dday_batch(
+                    results[scenario], col, params[number]
+                )
+
+    return dday
+
+
 if __name__ == "__main__":
     pass
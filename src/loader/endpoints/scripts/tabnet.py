@@ -0,0 +1,124 @@
+import hashlib
+import os
+from urllib.parse import urlencode, urljoin
+
+import requests
+from bs4 import BeautifulSoup
+
+
+class TabNet:
+    """
+    Cliente do TabNet (DataSUS): lê o formulário de uma tabulação
+    (deftohtm.exe) e envia a consulta direto para o tabcgi.exe, sem navegador.
+
+    Para rodar sem rede, passe `recordings` com uma pasta de respostas gravadas
+    (criada com `record=True`): as requisições são lidas dessa pasta.
+    """
+
+    base_url = "http://tabnet.datasus.gov.br/cgi/"
+    encoding = "latin-1"
+
+    def __init__(self, recordings=None, record=False, timeout=120):
+        self.recordings = recordings
+        self.record = record
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=10, max_retries=3)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _recording_path(self, method, url, data=None):
+        key = hashlib.sha1(repr((method, url, data)).encode("utf-8")).hexdigest()
+        return os.path.join(self.recordings, key[:16] + ".html")
+
+    def _request(self, method, url, data=None):
+
+        if self.recordings and not self.record:
+            with open(self._recording_path(method, url, data), "rb") as f:
+                return f.read().decode(self.encoding)
+
+        if method == "GET":
+            response = self.session.get(url, timeout=self.timeout)
+        else:
+            response = self.session.post(
+                url,
+                data=urlencode(data, encoding=self.encoding),
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=self.timeout,
+            )
+        response.raise_for_status()
+
+        if self.recordings:
+            os.makedirs(self.recordings, exist_ok=True)
+            with open(self._recording_path(method, url, data), "wb") as f:
+                f.write(response.content)
+
+        return response.content.decode(self.encoding)
+
+    def form(self, definition):
+        """
+        Lê o formulário da tabulação `definition` (ex: "cnes/cnv/leiintbr.def").
+
+        Returns
+        -------
+        dict
+            action: endereço da consulta
+            fields: lista de (campo, valor) com as opções padrão do formulário
+            updated: período mais recente disponível (ex: "Ago/2020")
+        """
+
+        html = self._request(
+            "GET", urljoin(self.base_url, "deftohtm.exe?" + definition)
+        )
+        soup = BeautifulSoup(html, "html.parser")
+
+        fields = []
+        for select in soup.find_all("select"):
+            options = select.find_all("option")
+            selected = [o for o in options if o.has_attr("selected")]
+            if not selected and not select.has_attr("multiple"):
+                selected = options[:1]
+            # Sem o atributo value, o navegador envia o texto da opcao
+            fields += [
+                (select["name"], o.get("value") or o.get_text(strip=True))
+                for o in selected
+            ]
+
+        for field in soup.find_all("input"):
+            kind = field.get("type", "text").lower()
+            if not field.get("name"):
+                continue
+            if kind in ("checkbox", "radio") and not field.has_attr("checked"):
+                continue
+            # Só o botão de mostrar a tabela é enviado
+            if kind in ("submit", "button", "reset", "image") and "mostra" not in (
+                field.get("class") or []
+            ):
+                continue
+            fields.append((field["name"], field.get("value", "")))
+
+        periods = soup.find(id="A")
+        updated = periods.find("option").get_text(strip=True) if periods else None
+
+        return {
+            "action": urljoin(self.base_url, soup.find("form")["action"]),
+            "fields": fields,
+            "updated": updated,
+        }
+
+    def query(self, form, **choices):
+        """
+        Envia a consulta com as opções padrão de `form`, trocando as dos campos
+        em `choices` (ex: Linha="Município", Coluna="Especialidade").
+
+        Returns
+        -------
+        str
+            HTML da tabela resultante
+        """
+
+        data = [(name, value) for name, value in form["fields"] if name not in choices]
+        data += list(choices.items())
+
+        return self._request("POST", form["action"], data)
@@ -19,11 +19,14 @@ from logger import logger
 from utils import (
     get_last,
     get_config,
-    build_file_path,
     get_endpoints,
+    write_csv,
+    write_feather,
 )
 
 from notifiers import get_notifier
+import scheduler
+from endpoints.helpers import invalidate
 
 import ssl
 
@@ -32,10 +35,18 @@ ssl._create_default_https_context = ssl._create_unverified_context
 
 def _write_data(data, endpoint):
 
-    output_path = build_file_path(endpoint)
-
     data["data_last_refreshed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data.to_csv(output_path, index=False)
+
+    # Troca atomica do CSV, com manifesto para o servidor
+    write_csv(data, endpoint)
+
+    # Copia tipada lida pelas proximas endpoints (allow_local)
+    try:
+        write_feather(data, endpoint)
+    except Exception as e:
+        logger.warning(
+            "TYPED COPY NOT WRITTEN FOR {}: {}", endpoint["python_file"], e
+        )
 
     logger.info(
         "WRITTING DATA FOR {}",
@@ -81,6 +92,9 @@ def main(endpoint):
 
             _write_data(data, endpoint)
 
+            # Proximas leituras dessa rodada carregam o dado recem escrito
+            invalidate(endpoint["python_file"])
+
     except Exception as e:
         logger.opt(exception=True).error("ERROR: {}", e)
         return e
@@ -89,17 +103,11 @@ def main(endpoint):
 
 
 if __name__ == "__main__":
-    hasError = False
-
-    for endpoint in get_endpoints():
-
-        if endpoint.get("skip"):
-            continue
 
-        err = main(endpoint)
-
-        if err is not None:
-            hasError = True
+    # Endpoints independentes rodam em paralelo, respeitando as dependencias
+    errors = scheduler.run(
+        get_endpoints(), main, max_workers=int(os.getenv("LOADER_MAX_WORKERS", 4))
+    )
 
-    if hasError:
+    if any(err is not None for err in errors.values()):
         exit(1)
@@ -0,0 +1,197 @@
+import ast
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from logger import logger
+
+endpoints_path = os.path.join(os.path.dirname(__file__), "endpoints")
+
+
+def _get_imports(python_file):
+    """Reads the imports of an endpoint module from `endpoints`.
+
+    Returns
+    -------
+    tuple
+        Modules imported as a whole (`from endpoints import get_x`) and modules
+        that only had names imported (`from endpoints.get_x import func`)
+    """
+
+    with open(os.path.join(endpoints_path, python_file + ".py"), "r") as f:
+        tree = ast.parse(f.read())
+
+    modules, names = set(), set()
+    for node in ast.walk(tree):
+
+        if isinstance(node, ast.ImportFrom) and node.module == "endpoints":
+            modules.update(alias.name for alias in node.names)
+
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            parts = node.module.split(".")
+            if parts[0] == "endpoints" and len(parts) == 2:
+                names.add(parts[1])
+
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                parts = alias.name.split(".")
+                if parts[0] == "endpoints" and len(parts) == 2:
+                    modules.add(parts[1])
+
+    def _is_endpoint(module):
+        return os.path.isfile(os.path.join(endpoints_path, module + ".py"))
+
+    return set(filter(_is_endpoint, modules)), set(filter(_is_endpoint, names))
+
+
+def get_dependencies(endpoints):
+    """Builds the dependency graph between the endpoints that will run.
+
+    An endpoint depends on every endpoint module it imports (their data is
+    pulled with `now()`) and on the dependencies of the modules it only imports
+    functions from (those functions may call `now()` of their own imports).
+    Extra dependencies can be declared in `endpoints.yaml` with `depends_on`.
+
+    Parameters
+    ----------
+    endpoints : list
+        Endpoints configuration from `endpoints.yaml`
+
+    Returns
+    -------
+    dict
+        Set of upstream `python_file`s for each scheduled `python_file`
+    """
+
+    scheduled = [e["python_file"] for e in endpoints if not e.get("skip")]
+
+    imports = dict()
+
+    def _upstream(python_file, visiting=()):
+
+        if python_file in visiting:
+            raise ValueError(
+                "Circular dependency between endpoints: {}".format(
+                    " -> ".join(visiting + (python_file,))
+                )
+            )
+
+        if python_file not in imports:
+            imports[python_file] = _get_imports(python_file)
+
+        modules, names = imports[python_file]
+        upstream = set(modules)
+        for module in modules | names:
+            upstream |= _upstream(module, visiting + (python_file,))
+
+        return upstream - {python_file}
+
+    graph = dict()
+    for endpoint in endpoints:
+        if endpoint.get("skip"):
+            continue
+
+        python_file = endpoint["python_file"]
+        modules, names = _get_imports(python_file)
+
+        upstream = set(modules) | set(endpoint.get("depends_on", []))
+        for module in names:
+            upstream |= _upstream(module)
+
+        # Dependencias que nao rodam nesse ciclo sao lidas/calculadas pelo allow_local
+        graph[python_file] = {u for u in upstream if u in scheduled} - {python_file}
+
+    _check_cycles(graph)
+
+    return graph
+
+
+def _check_cycles(graph):
+    """Raises ValueError if the scheduled endpoints depend on each other in a
+    cycle (e.g. two modules importing each other), which `run` could never
+    start.
+    """
+
+    done = set()
+
+    def _visit(python_file, path):
+
+        if python_file in path:
+            cycle = path[path.index(python_file) :] + (python_file,)
+            raise ValueError(
+                "Circular dependency between endpoints: {}".format(" -> ".join(cycle))
+            )
+
+        if python_file in done:
+            return
+
+        for upstream in sorted(graph[python_file]):
+            _visit(upstream, path + (python_file,))
+
+        done.add(python_file)
+
+    for python_file in graph:
+        _visit(python_file, ())
+
+
+def run(endpoints, runner, max_workers=4):
+    """Runs the endpoints respecting their dependencies, with independent
+    branches running concurrently.
+
+    An endpoint starts only after all its upstream endpoints finished, even if
+    any of them failed (it then falls back to the local data, as in the serial
+    run).
+
+    Parameters
+    ----------
+    endpoints : list
+        Endpoints configuration from `endpoints.yaml`
+    runner : callable
+        Function that runs one endpoint configuration and returns an error or None
+    max_workers : int
+        Maximum number of endpoints running at the same time
+
+    Returns
+    -------
+    dict
+        Runner result for each `python_file`
+    """
+
+    graph = get_dependencies(endpoints)
+    configs = {e["python_file"]: e for e in endpoints if not e.get("skip")}
+
+    # Keeps `endpoints.yaml` order as priority between ready endpoints
+    order = list(configs.keys())
+    results = dict()
+    running = dict()
+
+    def _ready():
+        return [
+            python_file
+            for python_file in order
+            if python_file not in results
+            and python_file not in running.values()
+            and graph[python_file].issubset(results.keys())
+        ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        while len(results) < len(order):
+
+            for python_file in _ready():
+                logger.debug(
+                    "SCHEDULING {} AFTER {}",
+                    python_file,
+                    sorted(graph[python_file]) or "-",
+                )
+                running[executor.submit(runner, configs[python_file])] = python_file
+
+            if not running:
+                # Should not happen: `get_dependencies` rejects cyclic graphs
+                raise RuntimeError("Endpoints left without runnable dependencies")
+
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return results
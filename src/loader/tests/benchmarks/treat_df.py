@@ -0,0 +1,35 @@
+"""
+Tempo do treat_df atual e do filtro anterior por local (groupby.apply) numa tabela
+do tamanho do caso_full (5570 municipios). Rodar de src/loader:
+
+    python -m tests.benchmarks.treat_df
+"""
+
+import time
+
+from endpoints import get_cities_cases
+from tests.reference import cases as reference
+
+config = {"br": {"cases": {"rename": {}}}}
+
+
+def _time(func, df, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(df.copy(), config)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+
+    df = reference.synthetic_caso_full(n_places=5570, n_days=200)
+    print("{} rows".format(len(df)))
+
+    before, expected = _time(reference.treat_df, df)
+    after, result = _time(get_cities_cases.treat_df, df)
+
+    print("groupby.apply: {:.2f}s".format(before))
+    print("map + compare: {:.2f}s ({:.1f}x)".format(after, before / after))
+    print("same rows: {}".format(result.equals(expected)))
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Os modulos do loader sao importados a partir de src/loader, como no container
+loader_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, loader_path)
+
+fixtures_path = os.path.join(loader_path, "tests", "fixtures")
+
+
+@pytest.fixture(autouse=True)
+def loader_env(tmp_path, monkeypatch):
+    """Roda cada teste em src/loader, com OUTPUT_DIR (e o cache) numa pasta temporaria."""
+
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    monkeypatch.chdir(loader_path)
+    monkeypatch.setenv("OUTPUT_DIR", str(output_dir))
+    monkeypatch.delenv("CACHE_DIR", raising=False)
+
+    return output_dir
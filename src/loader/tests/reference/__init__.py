@@ -0,0 +1,4 @@
+"""
+Implementacoes anteriores (por local, linha a linha) das rotinas reescritas, usadas
+pelos testes para garantir que as versoes atuais dao o mesmo resultado.
+"""
@@ -0,0 +1,103 @@
+"""
+Projecao de capacidade linha a linha (`df.apply`), como antes da versao em lote:
+uma chamada de `run_simulation` por local.
+"""
+
+import numpy as np
+import pandas as pd
+
+from endpoints.scripts.simulator import run_simulation
+
+
+def _calculate_recovered(df, params):
+
+    confirmed_adjusted = int(df[["confirmed_cases"]].sum() / df["notification_rate"])
+
+    if confirmed_adjusted == 0:  # dont have any cases yet
+        params["population_params"]["R"] = 0
+        return params
+
+    params["population_params"]["R"] = (
+        confirmed_adjusted
+        - params["population_params"]["I"]
+        - params["population_params"]["D"]
+    )
+
+    if params["population_params"]["R"] < 0:
+        params["population_params"]["R"] = (
+            confirmed_adjusted - params["population_params"]["D"]
+        )
+
+    return params
+
+
+def _prepare_simulation(row, place_id, config, place_specific_params, rt_upper=None):
+
+    # based on Alison Hill: 40% asymptomatic
+    symtomatic = [
+        (
+            int(
+                row["active_cases"]
+                * (1 - config["br"]["seir_parameters"]["asymptomatic_proportion"])
+            )
+            if not np.isnan(row["active_cases"])
+            else 1
+        )
+    ][0]
+
+    params = {
+        "population_params": {
+            "N": int(row["population"]),
+            "I": symtomatic,
+            "D": [int(row["deaths"]) if not np.isnan(row["deaths"]) else 0][0],
+        },
+        "place_specific_params": {
+            "fatality_ratio": place_specific_params["fatality_ratio"].loc[
+                int(row.name)
+            ],
+            "i1_percentage": place_specific_params["i1_percentage"].loc[int(row.name)],
+            "i2_percentage": place_specific_params["i2_percentage"].loc[int(row.name)],
+            "i3_percentage": place_specific_params["i3_percentage"].loc[int(row.name)],
+        },
+        "n_beds": row["number_beds"]
+        * config["br"]["simulacovid"]["resources_available_proportion"],
+        "n_icu_beds": row["number_icu_beds"]
+        * config["br"]["simulacovid"]["resources_available_proportion"],
+        "R0": {
+            "best": row["rt_most_likely"],  # só usamos o "best" neste caso
+            "worst": row["rt_high_95"],
+        },
+    }
+
+    # TODO: checar esses casos no calculo da subnotificacao!
+    if row["notification_rate"] != row["notification_rate"]:
+        return np.nan
+
+    if row["notification_rate"] == 0:
+        return np.nan
+
+    # TODO: precisa? Seleciona rt de 1 nivel acima caso não tenha
+    if row["rt_most_likely"] != row["rt_most_likely"]:
+        if place_id == "health_region_id":
+            rt = rt_upper.query(f"state_num_id == {row['state_num_id']}")
+        else:
+            return np.nan
+
+        if len(rt) > 0:
+            rt = rt.assign(
+                last_updated=lambda df: pd.to_datetime(df["last_updated"])
+            ).query("last_updated == last_updated.max()")
+            # Series de um valor no codigo original, que o numpy atual nao aceita
+            # como parametro do odeint
+            params["R0"] = {
+                "best": rt["Rt_most_likely"].iloc[0],
+                "worst": rt["Rt_high_95"].iloc[0],
+            }
+        else:
+            return np.nan
+
+    params = _calculate_recovered(row, params)
+
+    # Run simulation
+    dday = run_simulation(params, config)
+    return dday["icu_beds"]["best"]
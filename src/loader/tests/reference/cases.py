@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+
+def synthetic_caso_full(n_places=50, n_days=60, seed=0):
+    """Tabela no formato do caso_full do Brasil.io, com cidades e estados."""
+
+    rng = np.random.default_rng(seed)
+
+    places = np.arange(1100000, 1100000 + n_places)
+    dates = pd.date_range("2020-03-01", periods=n_days)
+
+    df = pd.DataFrame(
+        {
+            "city_ibge_code": np.repeat(places, n_days).astype(float),
+            "date": np.tile(dates.strftime("%Y-%m-%d"), n_places),
+            "place_type": np.where(
+                np.repeat(places, n_days) % 10 == 0, "state", "city"
+            ),
+            "last_available_date": "2020-09-01",
+            "last_available_death_rate": rng.random(n_places * n_days),
+            "new_confirmed": rng.integers(-5, 100, n_places * n_days),
+            "last_available_confirmed": rng.integers(-5, 5000, n_places * n_days),
+            "new_deaths": rng.integers(-1, 5, n_places * n_days),
+            "last_available_deaths": rng.integers(-1, 200, n_places * n_days),
+        }
+    )
+
+    # Cada local para numa data propria; as linhas depois dela sao descartadas
+    last = rng.integers(n_days // 2, n_days, n_places)
+    position = np.tile(np.arange(n_days), n_places)
+    df["is_last"] = position == np.repeat(last, n_days)
+
+    # Fora de ordem, como no arquivo
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def treat_df(df, config, place_type="city", place_id="city_ibge_code"):
+    """`get_cities_cases.treat_df` com o filtro por local via groupby.apply."""
+
+    df = df[df["place_type"] == place_type]
+
+    df = df.drop(
+        columns=["last_available_date", "last_available_death_rate", "place_type"]
+    )
+
+    ints = df.select_dtypes(include=["int64", "int32", "int16"]).columns
+    df[ints] = df[ints].apply(pd.to_numeric, downcast="integer")
+    floats = df.select_dtypes(include=["float"]).columns
+    df[floats] = df[floats].apply(pd.to_numeric, downcast="float")
+
+    df["date"] = pd.to_datetime(df["date"])
+    df = df.sort_values([place_id, "date"])
+
+    last_updated = df[df["is_last"] == True].set_index(place_id)["date"]
+    groups = df.groupby(place_id)
+    idxs = groups.apply(lambda group: group["date"] <= last_updated[group.name])
+    df = df.loc[idxs[idxs == True].index.get_level_values(level=1)]
+
+    df.loc[df["new_confirmed"] < 0, "new_confirmed"] = 0
+    df.loc[df["last_available_confirmed"] < 0, "last_available_confirmed"] = 0
+    df.loc[df["new_deaths"] < 0, "new_deaths"] = 0
+    df.loc[df["last_available_deaths"] < 0, "last_available_deaths"] = 0
+
+    return df.rename(columns=config["br"]["cases"]["rename"])
+
+
+def synthetic_rolling(n_places=30, n_days=45, seed=0):
+    """Casos por local com dias faltando, nulos e locais com poucas linhas."""
+
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame(
+        {
+            "city_id": np.repeat(np.arange(n_places), n_days).astype(float),
+            "last_updated": np.tile(
+                pd.date_range("2020-06-01", periods=n_days), n_places
+            ),
+            "daily_cases": rng.integers(0, 300, n_places * n_days).astype(float),
+            "new_deaths": rng.integers(0, 10, n_places * n_days).astype(float),
+            "Rt_most_likely": rng.random(n_places * n_days) * 2,
+        }
+    )
+    df["population"] = np.repeat(rng.integers(1000, 10**6, n_places), n_days)
+
+    for col in ["daily_cases", "new_deaths", "Rt_most_likely"]:
+        df.loc[rng.random(len(df)) < 0.05, col] = np.nan
+
+    # Dias sem dado, um local com menos de uma semana e linhas sem local
+    df = df[rng.random(len(df)) > 0.1]
+    df = df[(df["city_id"] != 0) | (df["last_updated"] < "2020-06-05")]
+    df.loc[df.sample(5, random_state=seed).index, "city_id"] = np.nan
+
+    # Locais intercalados, datas em ordem dentro de cada local
+    return df.sample(frac=1, random_state=seed).sort_values(
+        "last_updated", kind="mergesort"
+    )
+
+
+def _rolling_indicators(group, config, cols=["daily_cases"], weighted=True):
+    """`get_cities_cases.get_rolling_indicators` por local, antes das janelas NumPy."""
+
+    divide = group["population"].values[0] / 10**5 if weighted else 1
+
+    group = group.set_index("last_updated")
+
+    for col in cols:
+        if col == "daily_cases":
+            infectious_period = (
+                config["br"]["seir_parameters"]["severe_duration"]
+                + config["br"]["seir_parameters"]["critical_duration"]
+            )
+            group["infectious_period_cases"] = (
+                group[col].rolling(window=infectious_period, min_periods=1).sum()
+            )
+
+        group[f"{col}_mavg"] = (
+            group[col].rolling(window=7, min_periods=7).mean().round(1)
+        )
+        group[f"{col}_mavg_100k"] = group[f"{col}_mavg"] / divide
+
+        group[f"{col}_diff_14_days"] = (
+            np.sign(group[f"{col}_mavg"].diff()).rolling(14, min_periods=14).sum()
+        )
+        group[f"{col}_growth"] = "estabilizando"
+        group.loc[lambda x: x[f"{col}_diff_14_days"] >= 5, f"{col}_growth"] = (
+            "crescendo"
+        )
+        group.loc[lambda x: x[f"{col}_diff_14_days"] <= -14, f"{col}_growth"] = (
+            "decrescendo"
+        )
+
+    return group.reset_index()
+
+
+def get_rolling_indicators(df, config, place_id, cols=["daily_cases"], weighted=True):
+    """Como o `groups.apply` dos endpoints: um local por vez, na ordem dos ids."""
+
+    return pd.concat(
+        [
+            _rolling_indicators(group, config, cols, weighted)
+            for _, group in df.groupby(place_id)
+        ],
+        ignore_index=True,
+    )
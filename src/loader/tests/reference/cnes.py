@@ -0,0 +1,33 @@
+"""
+Leitura da tabela de resultado do TabNet celula a celula, como antes de
+`get_cnes._get_table`: uma linha do DataFrame por vez e o id separado do nome
+da cidade linha a linha.
+"""
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+
+def treat_city_name(df):
+    df["city_id"] = df["city_name"].split(" ", 1)[0]
+    df["city_name"] = df["city_name"].split(" ", 1)[1].strip("\n")
+    return df
+
+
+def get_table(html, columns, start, step):
+    """`columns`: nome de cada coluna e sua posicao a partir do inicio da linha"""
+
+    table = BeautifulSoup(html, "html.parser").find(class_="tabdados")
+    soup = BeautifulSoup(str(table), "html.parser")
+
+    df = pd.DataFrame(columns=list(columns))
+    x = soup.select("td")
+    y = soup.select("tr")
+    i = 0
+    k = start
+    for j in range(4, len(y)):
+        df.loc[i] = [x[k + offset].text for offset in columns.values()]
+        k = k + step
+        i = i + 1
+
+    return df.apply(treat_city_name, axis=1)
@@ -0,0 +1,135 @@
+"""
+Rt de Cori et al. por local, como antes da versao em NumPy: cada serie passava
+pelo `EpiEstim::estimate_R(method="parametric_si")`. Aqui as formulas do
+estimate_R estao transcritas dia a dia, no lugar da chamada ao R.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats as sps
+
+params = {"mean_si": 4.7, "std_si": 2.9, "mean_prior": 3, "std_prior": 5}
+
+
+def synthetic_cases(n_places=8, n_days=80, seed=0, place_id="city_id"):
+    """Casos diarios e confirmados por local e data, com os casos filtrados."""
+
+    rng = np.random.default_rng(seed)
+
+    frames = []
+    for i in range(n_places):
+        days = n_days - 5 * i
+        daily = rng.poisson(rng.uniform(2, 80) * np.exp(np.linspace(0, 1, days)))
+        frames.append(
+            pd.DataFrame(
+                {
+                    place_id: 1100000 + i,
+                    "last_updated": pd.date_range("2020-04-01", periods=days).astype(
+                        str
+                    ),
+                    "daily_cases": daily.astype(float),
+                    "confirmed_cases": np.cumsum(daily),
+                }
+            )
+        )
+    df = pd.concat(frames, ignore_index=True)
+
+    # Local com poucos casos, local com serie curta e local com casos negativos
+    df.loc[df[place_id] == 1100001, "confirmed_cases"] = 50
+    df = df[(df[place_id] != 1100002) | (df["last_updated"] < "2020-04-20")]
+    df.loc[
+        (df[place_id] == 1100003) & (df["last_updated"] > "2020-05-01"), "daily_cases"
+    ] = -5
+
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def discr_si(k, mu, sigma):
+    a = ((mu - 1) / sigma) ** 2
+    b = sigma**2 / (mu - 1)
+
+    def pgamma(x, shape):
+        return sps.gamma.cdf(x, shape, scale=b) if x > 0 else 0.0
+
+    res = k * pgamma(k, a) + (k - 2) * pgamma(k - 2, a) - 2 * (k - 1) * pgamma(k - 1, a)
+    res += a * b * (2 * pgamma(k - 1, a + 1) - pgamma(k - 2, a + 1) - pgamma(k, a + 1))
+    return max(0.0, res)
+
+
+def estimate_r(incid):
+    """Janelas de 7 dias comecando no segundo dia, como os padroes do estimate_R."""
+
+    T = len(incid)
+    si_distr = [discr_si(k, params["mean_si"], params["std_si"]) for k in range(T)]
+
+    infectivity = [
+        sum(si_distr[s] * incid[t - s] for s in range(1, t + 1)) for t in range(T)
+    ]
+
+    a_prior = (params["mean_prior"] / params["std_prior"]) ** 2
+    b_prior = params["std_prior"] ** 2 / params["mean_prior"]
+
+    rows = []
+    for t_start in range(1, T - 6):
+        t_end = t_start + 6
+        a = a_prior + sum(incid[t_start : t_end + 1])
+        b = 1 / (1 / b_prior + sum(infectivity[t_start : t_end + 1]))
+        rows.append(
+            {
+                "Rt_most_likely": a * b,
+                "Rt_low_95": sps.gamma.ppf(0.05, a, scale=b),
+                "Rt_high_95": sps.gamma.ppf(0.95, a, scale=b),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def run_epiestim(group):
+
+    # Remove valores nulos
+    group = group.dropna(subset=["I"])
+    # Filtra > 15 dias para cálculo
+    if len(group) < 15:
+        return
+    # Filtra séries não negativas
+    if any(group["I"] < 0):
+        return
+
+    rt = estimate_r(list(group["I"]))
+
+    # Recupera coluna de datas - começa depois de 7 dias
+    rt = rt.reset_index(drop=True).join(group.iloc[7:]["dates"].reset_index(drop=True))
+    return rt
+
+
+def get_rt(df, place_id):
+
+    # Agrega e filtra a série de casos: > 100 casos confirmados
+    df_cases = (
+        df[[place_id, "last_updated", "daily_cases", "confirmed_cases"]]
+        .dropna(subset=["daily_cases"])
+        .groupby([place_id, "last_updated"])
+        .agg({"daily_cases": "sum", "confirmed_cases": "sum"})
+        .reset_index()
+        .rename(columns={"last_updated": "dates"})
+        .assign(dates=lambda df: pd.to_datetime(df["dates"]))
+        .query("confirmed_cases >= 100")
+    )
+
+    # Calcula Rt com mavg de casos ativos, local por local
+    results = []
+    for place, group in (
+        df_cases.groupby(place_id)
+        .rolling(7, min_periods=7, on="dates")["daily_cases"]
+        .mean()
+        .reset_index()
+        .rename(columns={"daily_cases": "I"})
+        .groupby(place_id)
+    ):
+        rt = run_epiestim(group)
+        if rt is not None:
+            results.append(rt.assign(**{place_id: place}))
+
+    return pd.concat(results, ignore_index=True).rename(
+        columns={"dates": "last_updated"}
+    )
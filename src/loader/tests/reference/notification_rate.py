@@ -0,0 +1,18 @@
+import scipy
+from scipy.stats import nbinom
+
+
+def bin_neg_simulation(k, p, n=10000, odd=99):
+    """`get_notification_rate.bin_neg_simulation` de uma linha, antes do lote."""
+
+    if k <= 0:
+        return None
+    a = 100 - odd
+    b = odd + (100 - odd)
+    r = nbinom.rvs(k, p, size=n)
+    return int(
+        scipy.stats.tmean(
+            r,
+            (scipy.stats.scoreatpercentile(r, a), scipy.stats.scoreatpercentile(r, b)),
+        )
+    )
@@ -0,0 +1,98 @@
+import gzip
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from endpoints import get_cities_cases
+from endpoints.scripts import brasilio
+
+
+class _Dump:
+    """caso_full.csv.gz servido com ETag/Last-Modified, como o data.brasil.io."""
+
+    def __init__(self):
+        self.requests = []
+        self.update(b"city,date\nA,2020-09-01\n", "v1", "Tue, 01 Sep 2020 10:00:00 GMT")
+
+    def update(self, csv, etag, last_modified):
+        self.payload = gzip.compress(csv)
+        self.etag = '"{}"'.format(etag)
+        self.last_modified = last_modified
+
+
+@pytest.fixture
+def dump(monkeypatch):
+    dump = _Dump()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            not_modified = self.headers.get("If-None-Match") == dump.etag
+            dump.requests.append((self.path, 304 if not_modified else 200))
+
+            if not_modified:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("ETag", dump.etag)
+            self.send_header("Last-Modified", dump.last_modified)
+            self.send_header("Content-Length", str(len(dump.payload)))
+            self.end_headers()
+            self.wfile.write(dump.payload)
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        brasilio.BrasilIO,
+        "download_url",
+        "http://127.0.0.1:{}/dataset/".format(server.server_port),
+    )
+
+    yield dump
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_dump_costs_one_conditional_request(dump, tmp_path):
+    (tmp_path / "brasilio").mkdir()
+    path = str(tmp_path / "brasilio" / "caso_full.csv.gz")
+    client = brasilio.BrasilIO()
+
+    assert client.download_if_modified("covid19", "caso_full", path)
+    assert dump.requests == [("/dataset/covid19/caso_full.csv.gz", 200)]
+    first = os.stat(path)
+
+    # Sem mudanca: um 304 e o arquivo local nao e reescrito
+    assert not client.download_if_modified("covid19", "caso_full", path)
+    assert [status for _, status in dump.requests] == [200, 304]
+    assert os.stat(path).st_ino == first.st_ino
+    assert os.stat(path).st_mtime_ns == first.st_mtime_ns
+
+    # Dump novo: baixado num temporario e trocado de uma vez
+    dump.update(b"city,date\nA,2020-09-02\n", "v2", "Wed, 02 Sep 2020 10:00:00 GMT")
+    assert client.download_if_modified("covid19", "caso_full", path)
+    assert [status for _, status in dump.requests] == [200, 304, 200]
+    assert os.stat(path).st_ino != first.st_ino
+    assert gzip.open(path).read() == b"city,date\nA,2020-09-02\n"
+    assert sorted(os.listdir(os.path.dirname(path))) == [
+        "caso_full.csv.gz",
+        "caso_full.csv.gz.json",
+    ]
+
+
+def test_cities_and_states_share_one_check_per_run(dump, monkeypatch):
+    monkeypatch.setattr(get_cities_cases, "_checked_tables", set())
+
+    for _ in range(2):
+        assert get_cities_cases.download_brasilio_table().read() == (
+            "city,date\nA,2020-09-01\n"
+        )
+
+    assert [status for _, status in dump.requests] == [200]
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from endpoints import get_cities_cases
+from tests.reference import cases as reference
+
+config = {"br": {"cases": {"rename": {"new_confirmed": "daily_cases"}}}}
+
+
+def test_treat_df_matches_per_place_filter():
+    df = reference.synthetic_caso_full()
+
+    for place_type in ["city", "state"]:
+        expected = reference.treat_df(df.copy(), config, place_type)
+        result = get_cities_cases.treat_df(df.copy(), config, place_type)
+
+        pd.testing.assert_frame_equal(result, expected)
+        assert len(result) < (df["place_type"] == place_type).sum()
+
+
+def test_rolling_indicators_match_per_place_apply():
+    df = reference.synthetic_rolling()
+    config = {"br": {"seir_parameters": {"severe_duration": 6, "critical_duration": 8}}}
+
+    for cols, weighted in [
+        (["daily_cases", "new_deaths"], True),
+        (["Rt_most_likely"], False),
+    ]:
+        expected = reference.get_rolling_indicators(
+            df.copy(), config, "city_id", cols=cols, weighted=weighted
+        )
+        result = get_cities_cases.get_rolling_indicators(
+            df.copy(), config, "city_id", cols=cols, weighted=weighted
+        )
+
+        pd.testing.assert_frame_equal(result[expected.columns], expected)
+        assert (result[f"{cols[0]}_growth"] != "estabilizando").any()
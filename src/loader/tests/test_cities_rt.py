@@ -0,0 +1,178 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from endpoints import get_cities_rt
+from tests.reference import rt as reference
+
+config = {
+    "br": {
+        "rt_parameters": {
+            "gaussian_min_periods": 7,
+            "gaussian_kernel_std": 2,
+            "optimal_sigma": 0.01,
+            "gamma_alpha": 4,
+            "r_t_range_max": 12,
+            "min_days": 14,
+        },
+        "seir_parameters": {"mild_duration": 6, "incubation_period": 5},
+    }
+}
+
+columns = ["city_id", "last_updated", "Rt_most_likely", "Rt_low_95", "Rt_high_95"]
+
+
+def _sorted(df):
+    return df[columns].sort_values(["city_id", "last_updated"]).reset_index(drop=True)
+
+
+def test_batch_run_matches_per_place_posteriors():
+    df = reference.synthetic_cases_series()
+
+    # A versao anterior grava o eixo de Rt nos parametros
+    expected = _sorted(reference.sequential_run(df, copy.deepcopy(config), "city_id"))
+    result = _sorted(get_cities_rt.batch_run(df, config, "city_id", chunk_size=4))
+
+    # Locais de tamanhos diferentes, alinhados num mesmo eixo de datas
+    assert expected["city_id"].nunique() == 6
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_hdi_matches_n_by_n_search():
+    rng = np.random.default_rng(0)
+    r_t_range = np.linspace(0, 12, 1201)
+
+    # Posteriors largas, estreitas, com dois picos e com empates de largura
+    pmfs = [
+        rng.gamma(2, size=len(r_t_range)),
+        np.exp(-(((r_t_range - 1.2) / 0.05) ** 2)),
+        np.exp(-(((r_t_range - 0.5) / 0.3) ** 2))
+        + np.exp(-(((r_t_range - 3) / 0.3) ** 2)),
+        np.ones(len(r_t_range)),
+    ]
+    pmf = pd.DataFrame(
+        np.stack([p / p.sum() for p in pmfs], axis=1),
+        index=r_t_range,
+        columns=pd.date_range("2020-05-01", periods=len(pmfs)),
+    )
+
+    for p in [0.5, 0.9, 0.95]:
+        expected = reference.highest_density_interval(pmf, p=p)
+        pd.testing.assert_frame_equal(
+            get_cities_rt.highest_density_interval(pmf, p=p), expected
+        )
+        pd.testing.assert_series_equal(
+            get_cities_rt.highest_density_interval(pmf.iloc[:, 0], p=p),
+            reference.highest_density_interval(pmf.iloc[:, 0], p=p),
+        )
+
+    # Sem intervalo com mais que p da massa: os dois falham
+    for hdi in [
+        reference.highest_density_interval,
+        get_cities_rt.highest_density_interval,
+    ]:
+        with pytest.raises(ValueError):
+            hdi(pmf, p=1)
+
+
+def test_rt_jobs_share_the_cores_with_the_loader(monkeypatch):
+    monkeypatch.setattr(get_cities_rt.os, "cpu_count", lambda: 16)
+    monkeypatch.delenv("RT_N_JOBS", raising=False)
+
+    monkeypatch.setenv("LOADER_MAX_WORKERS", "4")
+    assert get_cities_rt.default_n_jobs() == 4
+
+    monkeypatch.setenv("LOADER_MAX_WORKERS", "32")
+    assert get_cities_rt.default_n_jobs() == 1
+
+    monkeypatch.setenv("RT_N_JOBS", "2")
+    assert get_cities_rt.default_n_jobs() == 2
+
+
+def test_parallel_batch_run_matches_sequential():
+    df = reference.synthetic_cases_series()
+
+    sequential = get_cities_rt.batch_run(df, config, "city_id", n_jobs=1)
+    parallel = get_cities_rt.batch_run(df, config, "city_id", n_jobs=2)
+
+    pd.testing.assert_frame_equal(_sorted(parallel), _sorted(sequential))
+
+
+def _incremental_run(df, config, state_path, monkeypatch):
+    """Rt com estado e dias recalculados de cada local (um so lote)."""
+
+    calculated = []
+    calculate_batch = get_cities_rt.calculate_batch
+
+    def spy(cases, *args, **kwargs):
+        calculated.append((~np.isnan(cases)).sum(axis=0))
+        return calculate_batch(cases, *args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(get_cities_rt, "calculate_batch", spy)
+        result = get_cities_rt.batch_run(df, config, "city_id", state_path=state_path)
+
+    places = sorted(df.index.get_level_values("city_id").unique())
+    return _sorted(result), dict(zip(places, np.concatenate(calculated)))
+
+
+def _until(df, day):
+    return df[df.index.get_level_values("last_updated") <= day]
+
+
+def test_resumed_run_matches_full_batch_run(tmp_path, monkeypatch):
+    df = reference.synthetic_cases_series()
+    last_day = df.index.get_level_values("last_updated").max()
+
+    for new_days in [1, 3]:
+        state_path = str(tmp_path / "rt_{}".format(new_days))
+        _incremental_run(
+            _until(df, last_day - pd.Timedelta(days=new_days)),
+            config,
+            state_path,
+            monkeypatch,
+        )
+
+        result, calculated = _incremental_run(df, config, state_path, monkeypatch)
+        full = _sorted(get_cities_rt.batch_run(df, config, "city_id"))
+
+        pd.testing.assert_frame_equal(result, full)
+
+        # So os dias depois do checkpoint (janela da suavizacao) sao refeitos
+        window = config["br"]["rt_parameters"]["gaussian_min_periods"]
+        assert set(calculated.values()) == {window + new_days}
+
+
+def test_changed_history_or_parameters_recalculate(tmp_path, monkeypatch):
+    df = reference.synthetic_cases_series()
+    state_path = str(tmp_path / "rt")
+
+    _incremental_run(df, config, state_path, monkeypatch)
+    _, fresh = _incremental_run(df, config, str(tmp_path / "fresh"), monkeypatch)
+
+    # Valor revisto no passado de um local e outro local com inicio diferente
+    revised = df.copy()
+    revised.loc[(1100002, pd.Timestamp("2020-04-20"))] += 40
+    revised = revised.drop([(1100003, pd.Timestamp("2020-04-10"))])
+    revised = revised.drop([(1100003, pd.Timestamp("2020-04-11"))])
+
+    result, calculated = _incremental_run(revised, config, state_path, monkeypatch)
+    pd.testing.assert_frame_equal(
+        result, _sorted(get_cities_rt.batch_run(revised, config, "city_id"))
+    )
+    assert calculated[1100002] == fresh[1100002]
+    assert calculated[1100003] == fresh[1100003] - 2
+    assert calculated[1100000] < fresh[1100000]
+
+    # Outros parametros do modelo: descarta o estado inteiro
+    changed = copy.deepcopy(config)
+    changed["br"]["rt_parameters"]["optimal_sigma"] = 0.02
+
+    result, calculated = _incremental_run(revised, changed, state_path, monkeypatch)
+    pd.testing.assert_frame_equal(
+        result, _sorted(get_cities_rt.batch_run(revised, changed, "city_id"))
+    )
+    assert calculated[1100000] == fresh[1100000]
+    assert calculated[1100002] == fresh[1100002]
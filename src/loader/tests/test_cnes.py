@@ -0,0 +1,123 @@
+import os
+
+import pandas as pd
+
+from endpoints import get_cnes
+from endpoints.scripts.tabnet import TabNet
+from tests.conftest import fixtures_path
+from tests.reference import cnes as reference
+
+# Formularios (deftohtm.exe) e resultados (tabcgi.exe) das tabulacoes do CNES, no
+# formato das paginas do TabNet, com os nomes de `TabNet._recording_path`. Para
+# gravar respostas novas: TabNet(recordings=<pasta>, record=True)
+recordings = os.path.join(fixtures_path, "tabnet")
+
+
+def test_form_reads_default_fields():
+    form = TabNet(recordings=recordings).form("cnes/cnv/leiintbr.def")
+
+    assert form["action"] == (
+        "http://tabnet.datasus.gov.br/cgi/tabcgi.exe?cnes/cnv/leiintbr.def"
+    )
+    assert form["updated"] == "Ago/2020"
+
+    # Opcao sem value (envia o texto), opcao vazia, radio marcado e checkbox e
+    # botoes de fora
+    fields = dict(form["fields"])
+    assert fields["SMunicípio"] == "Todas as categorias"
+    assert fields["SEsfera_jurídica"] == ""
+    assert fields["Arquivos"] == "lt2008.dbf"
+    assert fields["formato"] == "table"
+    assert "zeradas" not in fields
+
+
+def test_get_cnes_tables_from_recorded_queries():
+    tabnet = TabNet(recordings=recordings)
+
+    df_leitos, updatedate = get_cnes.get_leitos(tabnet, "cnes/cnv/leiintbr.def")
+    df_leitos_comp = get_cnes.get_urlleitoscomp(tabnet, "cnes/cnv/leiutibr.def")
+    df_respiradores = get_cnes.get_respiradores(tabnet, "cnes/cnv/equipobr.def")
+
+    assert get_cnes.get_date(updatedate) == "2020-8-01"
+
+    # Um municipio por linha, sem a linha de Total
+    for df in [df_leitos, df_leitos_comp, df_respiradores]:
+        assert len(df) == 10
+        assert df["city_id"].iloc[0] == "110001"
+        assert df["city_name"].iloc[0] == "Alta Floresta D'Oeste"
+        assert "Total" not in df["city_name"].values
+
+    assert df_leitos.set_index("city_id").loc["110001"].to_dict() == {
+        "city_name": "Alta Floresta D'Oeste",
+        "cirurgico_tot": "-",
+        "clinico_tot": "40",
+        "pediatrico_tot": "51",
+        "hospital_dia_tot": "186",
+    }
+    assert df_respiradores.set_index("city_id").loc["355030", "number_ventilators"] == (
+        "80"
+    )
+    assert list(df_leitos_comp.columns) == [
+        "city_name",
+        "UTI_adulto_I_tot",
+        "UTI_adulto_II_tot",
+        "UTI_adulto_III_tot",
+        "city_id",
+        "UTI_adulto_II_COVID_SUS",
+        "UTI_pediatrica_II_COVID_SUS",
+        "UTI_adulto_II_COVID_nao_SUS",
+        "UTI_pediatrica_II_COVID_nao_SUS",
+    ]
+
+
+def test_get_table_matches_cell_by_cell_parser():
+    tabnet = TabNet(recordings=recordings)
+
+    leitos = tabnet.form("cnes/cnv/leiintbr.def")
+    leitos_comp = tabnet.form("cnes/cnv/leiutibr.def")
+    equipamentos = tabnet.form("cnes/cnv/equipobr.def")
+
+    pages = [
+        (
+            tabnet.query(leitos, Linha="Município", Coluna="Especialidade"),
+            {"city_name": 0, "cirurgico_tot": 1, "clinico_tot": 2, "pediatrico_tot": 4},
+            10,
+            8,
+        ),
+        (
+            tabnet.query(equipamentos, Linha="Município", Coluna="Equipamento"),
+            {"city_name": 0, "number_ventilators": 54},
+            85,
+            83,
+        ),
+        (
+            tabnet.query(
+                leitos_comp, Linha="Município", Coluna="Leitos_complementares"
+            ),
+            {"city_name": 0, "UTI_adulto_I_tot": 5, "UTI_adulto_III_tot": 7},
+            24,
+            22,
+        ),
+        (
+            tabnet.query(
+                leitos_comp,
+                Linha="Município",
+                Coluna="Leitos_complementares",
+                Incremento="Quantidade_SUS",
+            ),
+            {"city_name": 0, "UTI_adulto_II_COVID_SUS": 1},
+            24,
+            22,
+        ),
+    ]
+
+    for html, columns, start, step in pages:
+        expected = reference.get_table(html, columns, start, step)
+        result = get_cnes._get_table(html, columns, start, step)
+
+        # Total fora, celulas vazias ("-") e nomes com varias palavras
+        assert "Total" not in result["city_name"].values
+        assert (result.drop(columns=["city_name", "city_id"]) == "-").any().any()
+        assert "Alta Floresta D'Oeste" in result["city_name"].values
+
+        pd.testing.assert_frame_equal(result.astype(object), expected.astype(object))
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from endpoints.scripts import epiestim_rt
+from tests.reference import epiestim as reference
+
+columns = ["city_id", "last_updated", "Rt_most_likely", "Rt_low_95", "Rt_high_95"]
+
+
+def _sorted(df):
+    return df[columns].sort_values(["city_id", "last_updated"]).reset_index(drop=True)
+
+
+def test_cori_rt_matches_per_place_estimate_r():
+    df = reference.synthetic_cases()
+
+    expected = _sorted(reference.get_rt(df, "city_id"))
+    result = _sorted(epiestim_rt.get_rt(df, "city_id"))
+
+    # Os locais filtrados (poucos casos, serie curta, negativos) ficam de fora
+    assert set(result["city_id"]) == {1100000, 1100004, 1100005, 1100006, 1100007}
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, rtol=1e-10)
+
+
+def test_discretised_serial_interval():
+    k = np.arange(30)
+    w = epiestim_rt.discr_si(k, 4.7, 2.9)
+
+    expected = [reference.discr_si(i, 4.7, 2.9) for i in k]
+    np.testing.assert_allclose(w, expected, rtol=1e-12, atol=1e-15)
+    assert w[0] == 0 and abs(w.sum() - 1) < 1e-4
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from endpoints import get_health_region_farolcovid_main as farolcovid
+from tests.reference import capacity as reference
+from tests.test_simulator import config as simulator_config
+
+config = {
+    "br": {
+        "seir_parameters": dict(
+            simulator_config["br"]["seir_parameters"], asymptomatic_proportion=0.4
+        ),
+        "simulacovid": {"resources_available_proportion": 0.5},
+    }
+}
+
+
+def _regions(n_places=60, seed=0):
+    rng = np.random.default_rng(seed)
+
+    population = rng.integers(20000, 2000000, n_places).astype(float)
+    df = pd.DataFrame(
+        {
+            "health_region_id": np.arange(11001, 11001 + n_places),
+            "state_num_id": rng.choice([11, 12, 13], n_places),
+            "population": population,
+            "active_cases": np.trunc(population * rng.uniform(0.0005, 0.01, n_places)),
+            "confirmed_cases": np.trunc(
+                population * rng.uniform(0.001, 0.02, n_places)
+            ),
+            "deaths": np.trunc(population * rng.uniform(0, 0.001, n_places)),
+            "notification_rate": rng.uniform(0.05, 0.5, n_places),
+            "number_beds": np.trunc(population * rng.choice([1e-4, 2e-3], n_places)),
+            "number_icu_beds": np.trunc(
+                population * rng.choice([2e-5, 1e-4, 1e-3], n_places)
+            ),
+            "rt_most_likely": rng.uniform(0.7, 1.8, n_places),
+        }
+    )
+    df["rt_high_95"] = df["rt_most_likely"] + 0.3
+
+    # Sem casos ativos ou mortes, sem taxa de notificacao e sem Rt (usa o do
+    # estado, exceto no estado 13, que nao tem Rt)
+    df.loc[0:5, "active_cases"] = np.nan
+    df.loc[6:10, "deaths"] = np.nan
+    df.loc[11:13, "notification_rate"] = np.nan
+    df.loc[14:15, "notification_rate"] = 0
+    df.loc[16:30, ["rt_most_likely", "rt_high_95"]] = np.nan
+
+    place_specific_params = pd.DataFrame(
+        {
+            "health_region_id": df["health_region_id"],
+            "fatality_ratio": rng.uniform(0.005, 0.02, n_places),
+            "i1_percentage": rng.uniform(0.8, 0.85, n_places),
+            "i2_percentage": rng.uniform(0.11, 0.15, n_places),
+            "i3_percentage": rng.uniform(0.03, 0.05, n_places),
+        }
+    )
+
+    rt_upper = pd.DataFrame(
+        {
+            "state_num_id": [11, 11, 12, 12],
+            "last_updated": ["2020-07-01", "2020-07-02", "2020-07-02", "2020-07-01"],
+            "Rt_most_likely": [0.9, 1.3, 1.1, 2.0],
+            "Rt_high_95": [1.2, 1.5, 1.4, 2.2],
+        }
+    )
+
+    return df.set_index("health_region_id"), place_specific_params, rt_upper
+
+
+def test_capacity_projection_matches_row_by_row_simulation():
+    df, place_specific_params, rt_upper = _regions()
+
+    expected = df.apply(
+        lambda row: reference._prepare_simulation(
+            row,
+            "health_region_id",
+            config,
+            place_specific_params.set_index("health_region_id"),
+            rt_upper,
+        ),
+        axis=1,
+    )
+    result = farolcovid.get_capacity_projection(
+        df, "health_region_id", config, place_specific_params, rt_upper
+    )
+
+    pd.testing.assert_series_equal(result, expected, check_dtype=False)
+    assert expected.isnull().any() and (expected == -1).any() and (expected > 1).any()
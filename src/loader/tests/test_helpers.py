@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from endpoints import helpers
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    """Endpoint ficticio com o arquivo local e a execucao contados."""
+
+    calls = {"read": 0, "run": 0}
+
+    def read_local(endpoint):
+        assert endpoint["python_file"] == "get_example"
+        calls["read"] += 1
+        return pd.DataFrame({"value": [calls["read"]]})
+
+    def now(config, day=None):
+        calls["run"] += 1
+        return pd.DataFrame({"value": [-calls["run"]]})
+
+    now.__module__ = "endpoints.get_example"
+
+    monkeypatch.setattr(helpers, "_cache", dict())
+    monkeypatch.setattr(helpers, "_key_locks", dict())
+    monkeypatch.setattr(helpers, "read_local", read_local)
+    monkeypatch.setattr(
+        helpers,
+        "get_endpoints",
+        lambda: [{"endpoint": "br/example", "python_file": "get_example"}],
+    )
+
+    return helpers.allow_local(now), calls
+
+
+def test_each_key_is_read_once(endpoint):
+    now, calls = endpoint
+    config = {"br": {"window": 7}}
+
+    assert now(config)["value"].tolist() == [1]
+    assert now({"br": {"window": 7}})["value"].tolist() == [1]
+    assert calls == {"read": 1, "run": 0}
+
+    # Outros argumentos, outra leitura
+    assert now(config, day="2020-09-01")["value"].tolist() == [2]
+    assert now(config, day="2020-09-01")["value"].tolist() == [2]
+    assert calls == {"read": 2, "run": 0}
+
+
+def test_callers_get_isolated_copies(endpoint):
+    now, calls = endpoint
+
+    first = now({})
+    first["value"] = 100
+    first["other"] = 1
+
+    again = now({})
+    assert again["value"].tolist() == [1]
+    assert list(again.columns) == ["value"]
+    assert calls["read"] == 1
+
+
+def test_force_and_invalidate_reload(endpoint):
+    now, calls = endpoint
+
+    now({})
+    assert now({}, force=True)["value"].tolist() == [-1]
+    assert now({})["value"].tolist() == [2]
+    assert calls == {"read": 2, "run": 1}
+
+    # main.py invalida depois de escrever a saida do endpoint
+    helpers.invalidate("get_example")
+    assert now({})["value"].tolist() == [3]
+    assert now({})["value"].tolist() == [3]
+    assert calls == {"read": 3, "run": 1}
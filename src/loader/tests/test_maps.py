@@ -0,0 +1,154 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+import pytest
+
+import utils
+from endpoints import get_maps
+
+
+@pytest.fixture
+def datawrapper(monkeypatch):
+    """API do Datawrapper local (DATAWRAPPER_API_URL): registra cada chamada."""
+
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, body=None):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            calls.append((self.command, self.path))
+
+            content = json.dumps(body).encode() if body is not None else b""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._reply({"metadata": {"visualize": {"basemap": "brazil"}}})
+
+        def do_POST(self):
+            self._reply({"id": "new", "publicId": "new"})
+
+        def do_PUT(self):
+            self._reply()
+
+        def do_PATCH(self):
+            self._reply({})
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv(
+        "DATAWRAPPER_API_URL", "http://127.0.0.1:{}/v3/".format(server.server_port)
+    )
+
+    yield calls
+
+    server.shutdown()
+    server.server_close()
+
+
+def _config():
+    return {
+        "br": {
+            "maps": {
+                "idStateCode": {"AC": 12, "SP": 35},
+                "idStatesMap": {"AC": "Ab1Cd", "SP": "Ef2Gh"},
+                "BR_ID": "Ij3Kl",
+                "MAP_FOLDER_ID": 1,
+            },
+            "farolcovid": {
+                "categories": {
+                    0: "novo normal",
+                    1: "moderado",
+                    2: "alto",
+                    3: "altissimo",
+                }
+            },
+        }
+    }
+
+
+def _farol(deaths=10):
+    cities = pd.DataFrame(
+        {
+            "state_id": ["AC", "AC", "SP"],
+            "city_id": [1200013, 1200054, 3550308],
+            "city_name": ["Acrelândia", "Assis Brasil", "São Paulo"],
+            "overall_alert": [0, None, 3],
+            "deaths": [deaths, 2, 12000],
+            "subnotification_rate": [0.5, 0.8, 0.3],
+        }
+    )
+    states = pd.DataFrame(
+        {
+            "state_id": ["SP", "AC"],
+            "state_name": ["São Paulo", "Acre"],
+            "overall_alert": [3, 1],
+            "deaths": [30000, 500],
+            "subnotification_rate": [0.3, 0.6],
+        }
+    )
+    return cities, states
+
+
+def _run(monkeypatch, cities, states):
+    def get_map_data(config, states_ids):
+        by_state = dict(tuple(cities.groupby("state_id")))
+        return {state_id: by_state[state_id] for state_id in states_ids}, states
+
+    monkeypatch.setattr(get_maps, "get_map_data", get_map_data)
+    out = get_maps.now(_config(), force=True)
+
+    # Saida publicada como no loader: a proxima rodada compara com esses hashes
+    endpoint = [e for e in utils.get_endpoints() if e["python_file"] == "get_maps"][0]
+    utils.write_csv(out, endpoint)
+    return out
+
+
+def _published(calls):
+    return sorted(
+        path.split("/")[3]
+        for method, path in calls
+        if method == "PUT" or path.endswith("/publish")
+    )
+
+
+def test_unchanged_maps_are_not_published_again(datawrapper, monkeypatch):
+    monkeypatch.delenv("IS_MAP_DEV", raising=False)
+    cities, states = _farol()
+
+    # Sem saida anterior: todos os mapas sao atualizados e publicados
+    first = _run(monkeypatch, cities, states)
+    assert _published(datawrapper) == sorted(["Ab1Cd", "Ef2Gh", "Ij3Kl"] * 2)
+    assert len(first) == 3
+
+    # Mesmos dados e layout: nenhuma chamada ao Datawrapper
+    del datawrapper[:]
+    second = _run(monkeypatch, cities, states)
+    assert datawrapper == []
+    pd.testing.assert_frame_equal(second, first)
+
+    # Dado novo em uma cidade do Acre: so o mapa do Acre e republicado
+    cities, states = _farol(deaths=11)
+    _run(monkeypatch, cities, states)
+    assert _published(datawrapper) == ["Ab1Cd", "Ab1Cd"]
+
+
+def test_hash_changes_with_the_layout(monkeypatch):
+    cities, states = _farol()
+    config = _config()
+    map_ = get_maps.Map(config, 1, basemapCMD="brazil-states-2018", data=states)
+
+    before = map_.hash("Ij3Kl")
+    layout = map_.layout()
+    layout["visualize"]["gradient"]["colors"][2]["c"] = "#000000"
+    monkeypatch.setattr(map_, "layout", lambda: layout)
+
+    assert map_.hash("Ij3Kl") != before
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from endpoints import get_cities_cases
+from endpoints.scripts import get_notification_rate
+from tests.reference import notification_rate as reference
+
+# Mortes (media movel) e mortalidade esperada das regionais
+grid_k, grid_p = [
+    grid.ravel()
+    for grid in np.meshgrid(
+        [0.5, 1, 3.5, 10, 40], [0.001, 0.005, 0.02, 0.1], indexing="ij"
+    )
+]
+
+# Erro padrao da media de n amostras da binomial negativa
+standard_error = np.sqrt(grid_k * (1 - grid_p)) / grid_p / np.sqrt(10000)
+
+
+def test_notification_rate_method_comes_from_config(monkeypatch):
+    methods = []
+
+    def now(df, place_id, method):
+        methods.append(method)
+        return df[[place_id, "last_updated"]].assign(notification_rate=0.5)
+
+    monkeypatch.setattr(get_notification_rate, "now", now)
+    df = pd.DataFrame({"health_region_id": [1], "last_updated": ["2020-06-01"]})
+
+    get_cities_cases._get_notification_rate(df, {"br": {}})
+    get_cities_cases._get_notification_rate(
+        df, {"br": {"notification_rate": {"method": "analytic"}}}
+    )
+
+    assert methods == ["simulation", "analytic"]
+
+
+def test_estimates_are_shared_by_float_noise_of_the_moving_average(monkeypatch):
+    monkeypatch.setattr(get_notification_rate, "_estimates", OrderedDict())
+    monkeypatch.setattr(get_notification_rate, "_loaded", set())
+
+    # A mesma media movel de 15 dias (52 mortes), com ruido de float
+    k = np.array([52 / 15, 3.4666666666666663, 3.46666666666667])
+    p = np.array([0.004, 0.004 + 1e-12, 0.004 - 1e-12])
+    assert len(set(k)) == 3
+
+    estimated = get_notification_rate.bin_neg_simulation(k, p)
+
+    assert len(get_notification_rate._estimates) == 1
+    assert (estimated == estimated[0]).all()
+    np.testing.assert_array_equal(
+        get_notification_rate.bin_neg_simulation(k[:1].round(6), p[:1]), estimated[:1]
+    )
+
+
+def test_analytic_mean_matches_simulation():
+    analytic = get_notification_rate._trimmed_mean_analytic(grid_k, grid_p, 1)
+    simulated = get_notification_rate._trimmed_mean_simulation(
+        grid_k, grid_p, 10000, 99, 2020
+    )
+
+    # Ate 5% (~2.5 erros padrao com k = 0.5, cauda mais longa); 1% a partir
+    # de k = 1
+    np.testing.assert_allclose(analytic, simulated, rtol=0.05)
+    np.testing.assert_allclose(analytic[grid_k >= 1], simulated[grid_k >= 1], rtol=0.01)
+
+
+def test_batched_simulation_matches_per_row_trimmed_mean(monkeypatch):
+    monkeypatch.setattr(get_notification_rate, "_estimates", OrderedDict())
+    monkeypatch.setattr(get_notification_rate, "_loaded", set())
+
+    np.random.seed(0)
+    expected = np.array(
+        [reference.bin_neg_simulation(*pair) for pair in zip(grid_k, grid_p)]
+    )
+    estimated = get_notification_rate.bin_neg_simulation(grid_k, grid_p)
+
+    # Diferenca de duas medias independentes, mais o arredondamento para baixo
+    assert (np.abs(estimated - expected) <= 5 * np.sqrt(2) * standard_error + 1).all()
+    assert np.isnan(get_notification_rate.bin_neg_simulation([0], [0.01])).all()
@@ -0,0 +1,55 @@
+import pytest
+
+import scheduler
+
+
+def _write_endpoints(path, modules):
+    for name, source in modules.items():
+        (path / (name + ".py")).write_text(source)
+
+
+def test_module_cycle_is_rejected_when_building_the_graph(tmp_path, monkeypatch):
+    _write_endpoints(
+        tmp_path,
+        {
+            "get_a": "from endpoints import get_b\n",
+            "get_b": "from endpoints import get_a\n",
+            "get_c": "",
+        },
+    )
+    monkeypatch.setattr(scheduler, "endpoints_path", str(tmp_path))
+
+    endpoints = [{"python_file": name} for name in ["get_a", "get_b", "get_c"]]
+
+    with pytest.raises(ValueError, match="get_a -> get_b -> get_a"):
+        scheduler.get_dependencies(endpoints)
+
+    # Nada roda se o grafo tem ciclo
+    ran = []
+    with pytest.raises(ValueError):
+        scheduler.run(endpoints, lambda endpoint: ran.append(endpoint))
+    assert ran == []
+
+
+def test_dependencies_run_before_dependents(tmp_path, monkeypatch):
+    _write_endpoints(
+        tmp_path,
+        {
+            "get_a": "",
+            "get_b": "from endpoints import get_a\n",
+            "get_c": "from endpoints.get_b import something\n",
+        },
+    )
+    monkeypatch.setattr(scheduler, "endpoints_path", str(tmp_path))
+
+    endpoints = [{"python_file": name} for name in ["get_c", "get_b", "get_a"]]
+    assert scheduler.get_dependencies(endpoints) == {
+        "get_a": set(),
+        "get_b": {"get_a"},
+        "get_c": {"get_a"},
+    }
+
+    ran = []
+    scheduler.run(endpoints, lambda endpoint: ran.append(endpoint["python_file"]))
+    assert ran.index("get_a") < ran.index("get_b")
+    assert ran.index("get_a") < ran.index("get_c")
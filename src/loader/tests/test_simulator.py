@@ -0,0 +1,86 @@
+import numpy as np
+
+from endpoints.scripts import simulator
+
+config = {
+    "br": {
+        "seir_parameters": {
+            "doubling_rate": 1.15,
+            "incubation_period": 5.8,
+            "mild_duration": 6,
+            "severe_duration": 6,
+            "critical_duration": 8,
+        }
+    }
+}
+
+
+def _places(n_places=40, seed=0):
+    rng = np.random.default_rng(seed)
+
+    N = rng.integers(20000, 2000000, n_places).astype(float)
+    best = rng.uniform(0.7, 1.8, n_places)
+    return {
+        "population_params": {
+            "N": N,
+            "I": np.trunc(N * rng.uniform(0.0005, 0.01, n_places)),
+            "R": np.trunc(N * rng.uniform(0, 0.05, n_places)),
+            "D": np.trunc(N * rng.uniform(0, 0.001, n_places)),
+        },
+        "place_specific_params": {
+            "fatality_ratio": rng.uniform(0.005, 0.02, n_places),
+            "i1_percentage": rng.uniform(0.8, 0.85, n_places),
+            "i2_percentage": rng.uniform(0.11, 0.15, n_places),
+            "i3_percentage": rng.uniform(0.03, 0.05, n_places),
+        },
+        # Leitos de sobra, no limite e ja ocupados no primeiro dia
+        "n_beds": N * rng.choice([1e-5, 1e-3, 1e-2], n_places),
+        "n_icu_beds": N * rng.choice([1e-6, 1e-4, 1e-3], n_places),
+        "R0": {"best": best, "worst": best + rng.uniform(0, 0.5, n_places)},
+    }
+
+
+def test_batch_ddays_match_per_place_simulation():
+    params = _places()
+
+    dday = simulator.run_simulation_batch(params, config)
+
+    for i in range(len(params["R0"]["best"])):
+        place = {
+            key: {k: v[i] for k, v in params[key].items()}
+            for key in ["population_params", "place_specific_params", "R0"]
+        }
+        place["n_beds"] = params["n_beds"][i]
+        place["n_icu_beds"] = params["n_icu_beds"][i]
+
+        expected = simulator.run_simulation(place, config)
+
+        for resource in ["beds", "icu_beds"]:
+            for bound in ["worst", "best"]:
+                assert dday[resource][bound][i] == expected[resource][bound]
+
+    # Os tres casos de D-day aparecem: no primeiro dia, depois e nunca
+    ddays = np.concatenate([dday[r][b] for r in dday for b in dday[r]])
+    assert (ddays == 1).any() and (ddays > 1).any() and (ddays == -1).any()
+
+
+def test_fractional_ddays_round_up_to_the_daily_grid():
+    params = _places()
+
+    grid = simulator.run_simulation_batch(params, config)
+    fractional = simulator.run_simulation_batch(params, config, events=True)
+
+    never = []
+    for resource in grid:
+        for bound in grid[resource]:
+            expected = grid[resource][bound]
+            dday = fractional[resource][bound]
+
+            # Cruzamento entre os dias d - 1 e d do grid: D-day d
+            np.testing.assert_array_equal(np.ceil(dday), expected)
+            assert (dday[expected > 1] % 1 > 0).any()
+            never.append(dday[expected == -1])
+
+    # Sem cruzamento em 90 dias: -1, como no grid
+    never = np.concatenate(never)
+    assert len(never) and (never == -1).all()
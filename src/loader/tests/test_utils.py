@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def sheets():
+    """Planilhas servidas como o export CSV do Google Drive."""
+
+    # As duas requisicoes so sao respondidas quando ambas chegaram
+    both = threading.Barrier(2, timeout=10)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            both.wait()
+            name = self.path.split("/")[1]
+            payload = "sheet,row\n{0},1\n{0},2\n".format(name).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield "http://127.0.0.1:{}".format(server.server_port)
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_drive_downloads_get_their_own_frame(sheets, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    os.mkdir(tempfile.tempdir)
+
+    with ThreadPoolExecutor(2) as pool:
+        frames = list(
+            pool.map(
+                utils.download_from_drive,
+                [sheets + "/places", sheets + "/sectors"],
+            )
+        )
+
+    assert frames[0]["sheet"].tolist() == ["places", "places"]
+    assert frames[1]["sheet"].tolist() == ["sectors", "sectors"]
+    assert os.listdir(tempfile.tempdir) == []
+
+
+def _output():
+    """Saida de endpoint com ids como texto, datas, booleanos e nulos."""
+
+    return pd.DataFrame(
+        {
+            "city_id": ["3550308", "1200013", "3550308"],
+            "city_name": ["São Paulo", "Acrelândia", "São Paulo"],
+            "state_id": ["SP", "AC", "SP"],
+            "last_updated": pd.to_datetime(["2020-09-01", "2020-09-01", "2020-09-02"]),
+            "is_last": [False, True, True],
+            "rt": [1.1, np.nan, 0.9],
+            "health_region_id": [35016, np.nan, 35016],
+            "data_last_refreshed": "2020-09-02 10:00:00",
+        }
+    )
+
+
+def test_typed_copy_keeps_the_csv_values():
+    endpoint = {"endpoint": "br/example"}
+    utils.write_csv(_output(), endpoint)
+    utils.write_feather(_output(), endpoint)
+
+    csv = pd.read_csv(utils.build_file_path(endpoint))
+    typed = utils.read_local(endpoint)
+
+    assert pd.api.types.is_datetime64_any_dtype(typed["last_updated"])
+    assert pd.api.types.is_bool_dtype(typed["is_last"])
+    pd.testing.assert_series_equal(
+        typed["last_updated"], pd.to_datetime(csv["last_updated"]), check_dtype=False
+    )
+    pd.testing.assert_frame_equal(
+        typed.drop(columns=["last_updated"]), csv.drop(columns=["last_updated"])
+    )
+
+
+def test_feather_older_than_the_csv_is_ignored():
+    endpoint = {"endpoint": "br/example"}
+    utils.write_feather(_output(), endpoint)
+    utils.write_csv(_output().iloc[:1], endpoint)
+
+    feather_path = utils.build_file_path(endpoint, "feather")
+    csv_mtime = os.path.getmtime(utils.build_file_path(endpoint))
+    os.utime(feather_path, (csv_mtime - 60, csv_mtime - 60))
+
+    data = utils.read_local(endpoint)
+    assert len(data) == 1
+    assert data["last_updated"].tolist() == ["2020-09-01"]
+
+    # Copia de novo mais nova: volta a ser usada
+    os.utime(feather_path, (csv_mtime + 60, csv_mtime + 60))
+    assert len(utils.read_local(endpoint)) == 3
+
+
+def test_csv_is_published_before_its_manifest(monkeypatch):
+    endpoint = {"endpoint": "br/example"}
+    csv_path = utils.build_file_path(endpoint)
+    manifest_path = utils.build_file_path(endpoint, "manifest.json")
+
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(
+        utils.os, "replace", lambda src, dst: replaced.append(dst) or replace(src, dst)
+    )
+
+    utils.write_csv(_output(), endpoint)
+
+    assert replaced == [csv_path, manifest_path]
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    with open(csv_path, "rb") as f:
+        raw = f.read()
+    assert manifest["rows"] == len(_output()) == len(pd.read_csv(csv_path))
+    assert manifest["sha256"] == hashlib.sha256(raw).hexdigest()
+
+    # Falha no meio da escrita: CSV e manifesto anteriores continuam inteiros
+    def broken_to_csv(self, path, **kwargs):
+        with open(path, "w") as f:
+            f.write("city_id,city_na")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(pd.DataFrame, "to_csv", broken_to_csv)
+    with pytest.raises(OSError):
+        utils.write_csv(_output().iloc[:1], endpoint)
+
+    with open(csv_path, "rb") as f:
+        assert f.read() == raw
+    with open(manifest_path) as f:
+        assert json.load(f) == manifest
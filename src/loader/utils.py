@@ -13,6 +13,10 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import io
 import binascii
+import hashlib
+import json
+from datetime import datetime
+from pyarrow import feather
 
 configs_path = os.path.join(os.path.dirname(__file__), "endpoints/scripts")
 
@@ -62,7 +66,7 @@ def gen_googledrive_token(credentials_path, out_token_path):
 ## == // ==
 
 
-def build_file_path(endpoint):
+def build_file_path(endpoint, extension="csv"):
 
     if "_ROUTE" in endpoint["endpoint"]:
         route = os.getenv(endpoint["endpoint"])
@@ -71,7 +75,111 @@ def build_file_path(endpoint):
 
     fn = route.replace("/", "-")
 
-    return "/".join([os.getenv("OUTPUT_DIR"), fn]) + ".csv"
+    return "/".join([os.getenv("OUTPUT_DIR"), fn]) + "." + extension
+
+
+def build_cache_path(*parts):
+    """
+    Caminho para dados brutos/intermediários guardados entre as rodadas do loader
+    (CACHE_DIR, por padrão OUTPUT_DIR/.cache).
+    """
+    cache_dir = os.getenv("CACHE_DIR") or os.path.join(os.getenv("OUTPUT_DIR"), ".cache")
+    path = os.path.join(cache_dir, *parts)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _as_csv_types(data):
+    """
+    Mantém os tipos de datas, categorias, booleanos e números reduzidos, mas dá às
+    colunas de texto o tipo que a leitura do CSV daria (ex: ids numéricos como
+    número), para que os consumidores recebam os mesmos ids de antes.
+    """
+    data = data.reset_index(drop=True)
+
+    for col in data.select_dtypes(include=["object"]).columns:
+        kind = pd.api.types.infer_dtype(data[col], skipna=True)
+
+        if kind in ["boolean", "empty", "datetime", "date"]:
+            continue
+
+        numeric = pd.to_numeric(data[col], errors="coerce")
+        if numeric.notnull().sum() == data[col].notnull().sum():
+            data[col] = numeric
+        elif kind != "string":
+            data[col] = data[col].where(data[col].isnull(), data[col].astype(str))
+
+    return data
+
+
+def _replace(path, write):
+    # Escreve num arquivo temporário da mesma pasta e troca de uma vez: quem lê
+    # o caminho vê o arquivo antigo ou o novo inteiro, nunca um pela metade
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_csv(data, endpoint):
+    """
+    Publica o CSV da endpoint de forma atômica e, depois dele, o manifesto
+    (<endpoint>.manifest.json) com versão, número de linhas e sha256 do CSV.
+    O servidor só troca o dado servido quando o CSV confere com o manifesto.
+    """
+    manifest = {
+        "version": datetime.now().strftime("%Y%m%d%H%M%S%f"),
+        "rows": len(data),
+    }
+
+    def _write(path):
+        data.to_csv(path, index=False)
+        manifest["sha256"] = _sha256(path)
+
+    _replace(build_file_path(endpoint), _write)
+
+    def _write_manifest(path):
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+
+    _replace(build_file_path(endpoint, "manifest.json"), _write_manifest)
+
+
+def write_feather(data, endpoint):
+    """
+    Escreve uma cópia tipada (Arrow/Feather, sem compressão para permitir leitura
+    por memory map) ao lado do CSV da endpoint.
+    """
+    _replace(
+        build_file_path(endpoint, "feather"),
+        lambda path: feather.write_feather(
+            _as_csv_types(data), path, compression="uncompressed"
+        ),
+    )
+
+
+def read_local(endpoint):
+    """
+    Lê o dado local da endpoint: usa a cópia Feather se ela for mais nova que o
+    CSV, senão lê o CSV.
+    """
+    csv_path = build_file_path(endpoint)
+    feather_path = build_file_path(endpoint, "feather")
+
+    csv_mtime = os.path.getmtime(csv_path)
+
+    if os.path.exists(feather_path) and os.path.getmtime(feather_path) >= csv_mtime:
+        return feather.read_feather(feather_path, memory_map=True)
+
+    return pd.read_csv(csv_path)
 
 
 def _remove_accents(text):
@@ -138,20 +246,26 @@ def get_last(_df, sort_by="last_updated"):
 
 
 def download_from_drive(url):
-    temp_path = tempfile.gettempdir() + "/temp.csv"
-
-    response = subprocess.run(
-        [
-            "wget",
-            "--no-check-certificate",
-            "-q",
-            "-O",
-            temp_path,
-            url + "/export?format=csv",
-        ]
-    )
-
-    return pd.read_csv(temp_path)
+    # Um arquivo por chamada: endpoints rodando ao mesmo tempo baixam planilhas
+    # diferentes
+    fd, temp_path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+
+    try:
+        response = subprocess.run(
+            [
+                "wget",
+                "--no-check-certificate",
+                "-q",
+                "-O",
+                temp_path,
+                url + "/export?format=csv",
+            ]
+        )
+
+        return pd.read_csv(temp_path)
+    finally:
+        os.remove(temp_path)
 
 
 def get_config(url=os.getenv("CONFIG_URL")):
@@ -0,0 +1,337 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from datetime import timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:
+    # Sem brotli, as respostas sao comprimidas so com gzip
+    brotli = None
+
+# Colunas que podem ser filtradas na url (ex: ?state_id=SP)
+INDEXED_COLUMNS = ["state_id", "city_id", "city_name"]
+
+# Ids dos lugares, do mais especifico ao mais geral, para achar a ultima data de
+# cada lugar nas tabelas sem a coluna is_last
+PLACE_COLUMNS = ["city_id", "health_region_id", "state_num_id", "state_id"]
+
+# Colunas dos filtros de periodo (since, until, is_last) e do Last-Modified
+DATE_COLUMNS = ["last_updated", "is_last", "data_last_refreshed"]
+
+NO_ROWS = np.array([], dtype=int)
+
+# Compressoes aceitas, na ordem de preferencia do servidor
+ENCODINGS = ["br", "gzip"] if brotli else ["gzip"]
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class Table:
+    """
+    Conteudo de um arquivo de saida do loader, mantido em memoria: o CSV original,
+    os limites de cada linha nele e as posicoes das linhas de cada id.
+
+    So as colunas dos indices e filtros sao lidas ao carregar; as outras ficam
+    so nos bytes do arquivo e sao lidas quando uma resposta pede `columns`.
+    """
+
+    def __init__(self, raw, version=None):
+        self.raw = raw
+        self.version = version
+
+        # Cada linha do CSV e servida com os bytes do arquivo, sem reescrever
+        breaks = np.flatnonzero(np.frombuffer(raw, dtype=np.uint8) == ord("\n")) + 1
+        if len(raw) and raw[-1:] != b"\n":
+            breaks = np.append(breaks, len(raw))
+
+        self.header = raw[: breaks[0]] if len(breaks) else raw
+        self.starts, self.ends = breaks[:-1], breaks[1:]
+        self.columns = next(csv.reader(io.StringIO(self.header.decode("utf-8"))), [])
+
+        place = [col for col in PLACE_COLUMNS if col in self.columns][:1]
+        used = [
+            col for col in self.columns if col in INDEXED_COLUMNS + DATE_COLUMNS + place
+        ]
+        data = self._read(used or self.columns[:1])
+        self.n_rows = len(data)
+
+        # Campos com quebra de linha: as linhas do arquivo nao sao as do CSV
+        if len(self.starts) != self.n_rows:
+            self.starts = self.ends = None
+
+        # Ultima atualizacao do dado, para o Last-Modified das respostas
+        self.last_refreshed = None
+        if "data_last_refreshed" in data.columns:
+            # Datas no formato "%Y-%m-%d %H:%M:%S": a maior string e a mais nova
+            last = pd.to_datetime(data["data_last_refreshed"].max())
+            if not pd.isnull(last):
+                self.last_refreshed = last.to_pydatetime().replace(tzinfo=timezone.utc)
+
+        self.indexes = {
+            col: data.groupby(col, sort=False).indices
+            for col in INDEXED_COLUMNS
+            if col in data.columns
+        }
+
+        # Linhas ordenadas por last_updated (YYYY-MM-DD), para filtrar periodos
+        # com busca binaria, e linhas da ultima data de cada lugar
+        self.dates = self.dates_order = self.last_rows = None
+        if "last_updated" in data.columns:
+            dates = data["last_updated"]
+            self.dates_order = np.flatnonzero(dates.notnull().values)
+            self.dates_order = self.dates_order[
+                np.argsort(dates.values[self.dates_order], kind="stable")
+            ]
+            self.dates = dates.values[self.dates_order]
+
+            if "is_last" in data.columns:
+                self.last_rows = np.flatnonzero(
+                    (data["is_last"].str.lower() == "true").values
+                )
+            elif place:
+                last = dates.groupby(data[place[0]]).transform("max")
+                self.last_rows = np.flatnonzero((dates == last).values)
+
+        # Arquivo inteiro e cada estado comprimidos uma vez, ao carregar
+        self.compressed = dict()
+        slices = dict(self.indexes.get("state_id", dict()))
+        slices[None] = None
+        for state_id, positions in slices.items():
+            body = self.to_csv(positions)
+            for encoding in ENCODINGS:
+                self.compressed[(state_id, encoding)] = compress(body, encoding)
+
+    def _read(self, columns, positions=None):
+        """As `columns` das linhas em `positions` (todas se None), como texto."""
+
+        if not columns:
+            return pd.DataFrame()
+
+        if positions is None or self.starts is None:
+            raw = self.raw
+        else:
+            raw = self.header + b"".join(
+                [self.raw[self.starts[i] : self.ends[i]] for i in positions]
+            )
+
+        data = pd.read_csv(io.BytesIO(raw), dtype=str, usecols=set(columns))
+        if positions is not None and self.starts is None:
+            data = data.iloc[positions]
+        return data[columns]
+
+    def between(self, since=None, until=None):
+        """Posicoes, em ordem, das linhas com last_updated entre since e until."""
+
+        if self.dates is None:
+            return NO_ROWS
+
+        start = np.searchsorted(self.dates, since, "left") if since else 0
+        end = np.searchsorted(self.dates, until, "right") if until else len(self.dates)
+        return np.sort(self.dates_order[start:end])
+
+    def select(self, filters, since=None, until=None, is_last=False):
+        """
+        Posicoes das linhas com todos os valores de `filters` (coluna -> valor),
+        com last_updated entre `since` e `until` (inclusive) e, se `is_last`, so
+        da ultima data de cada lugar, em ordem. None se nao ha filtro.
+        """
+        found = [
+            self.indexes.get(col, dict()).get(value, NO_ROWS)
+            for col, value in filters.items()
+        ]
+        if since or until:
+            found.append(self.between(since, until))
+        if is_last:
+            found.append(NO_ROWS if self.last_rows is None else self.last_rows)
+
+        positions = None
+        for rows in sorted(found, key=len):
+            if positions is None:
+                positions = rows
+            else:
+                positions = np.intersect1d(positions, rows, assume_unique=True)
+
+        return positions
+
+    def to_csv(self, positions=None, columns=None):
+        """
+        CSV com o cabecalho e as linhas em `positions` (todas se None), so com
+        as `columns` pedidas (todas se nenhuma).
+        """
+
+        # Colunas desconhecidas sao ignoradas (a api responde 400 antes)
+        columns = [col for col in columns or [] if col in self.columns]
+        if columns:
+            return self._read(columns, positions).to_csv(index=False).encode("utf-8")
+
+        if positions is None:
+            return self.raw
+
+        if self.starts is None:
+            data = self._read(self.columns, positions)
+            return data.to_csv(index=False).encode("utf-8")
+
+        return self.header + b"".join(
+            [self.raw[self.starts[i] : self.ends[i]] for i in positions]
+        )
+
+    def body(
+        self,
+        filters,
+        encoding=None,
+        columns=None,
+        since=None,
+        until=None,
+        is_last=False,
+    ):
+        """
+        Corpo da resposta com as linhas e colunas pedidas (ver `select` e
+        `to_csv`), comprimido com `encoding`. Tabela inteira e filtro so por
+        estado saem ja comprimidos.
+        """
+        key = None
+        if not (columns or since or until or is_last):
+            if not filters:
+                key = (None, encoding)
+            elif list(filters) == ["state_id"]:
+                key = (filters["state_id"], encoding)
+
+        if encoding and key in self.compressed:
+            return self.compressed[key]
+
+        body = self.to_csv(self.select(filters, since, until, is_last), columns)
+        return compress(body, encoding) if encoding else body
+
+
+class Datasets:
+    """
+    Tabelas das saidas em OUTPUT_DIR, carregadas no primeiro acesso e de novo
+    quando o arquivo muda.
+
+    O loader publica cada CSV com um manifesto (<entry>.manifest.json: versao,
+    linhas e sha256). A nova tabela so substitui a servida quando confere com o
+    manifesto; ate la, as requisicoes continuam recebendo a versao anterior.
+    Sem manifesto, a versao e a data de modificacao e o tamanho do arquivo.
+
+    Novas versoes sao carregadas numa thread: so a primeira requisicao de cada
+    arquivo espera a leitura e a compressao.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._tables = dict()
+        self._lock = threading.Lock()
+        self._path_locks = dict()
+        self._reloading = dict()
+
+    def path(self, entry, extension="csv"):
+        return os.path.join(self.output_dir, entry.replace("/", "-") + "." + extension)
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, path, manifest_path):
+        """
+        Le o CSV e confere com o manifesto. Retorna None se o CSV ainda nao e o
+        do manifesto.
+        """
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = None
+
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        if manifest is None:
+            stat = os.stat(path)
+            return Table(raw, "{}-{}".format(stat.st_mtime_ns, stat.st_size))
+
+        if hashlib.sha256(raw).hexdigest() != manifest["sha256"]:
+            return None
+
+        table = Table(raw, str(manifest["version"]))
+        if table.n_rows != manifest["rows"]:
+            return None
+
+        return table
+
+    def _reload(self, path, manifest_path, key):
+        """Carrega a versao `key` de `path`, se ainda nao e a servida."""
+
+        cached = self._tables.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        table = self._load(path, manifest_path)
+
+        if table is None:
+            # CSV e manifesto de versoes diferentes (publicacao em curso):
+            # continua servindo a tabela anterior ate o manifesto mudar
+            if cached:
+                table = cached[1]
+            else:
+                with open(path, "rb") as f:
+                    table = Table(f.read(), "{}-{}".format(*key[0]))
+
+        self._tables[path] = (key, table)
+        return table
+
+    def _reload_in_background(self, path, manifest_path, key, lock):
+        try:
+            self._reload(path, manifest_path, key)
+        finally:
+            lock.release()
+
+    def get(self, entry):
+        """Tabela atual de `entry` (ex: br/cities/cases/full)."""
+
+        path = self.path(entry)
+        manifest_path = self.path(entry, "manifest.json")
+
+        stat = self._stat(path)
+        if stat is None:
+            raise FileNotFoundError(path)
+        key = (stat, self._stat(manifest_path))
+
+        # Leitura sem trava: a referencia da tabela e trocada de uma vez
+        cached = self._tables.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with self._lock:
+            lock = self._path_locks.setdefault(path, threading.Lock())
+
+        # Sem versao anterior, a requisicao espera o primeiro carregamento
+        if cached is None:
+            with lock:
+                return self._reload(path, manifest_path, key)
+
+        # Com versao anterior, um so carregamento por arquivo, fora das
+        # requisicoes: todas recebem a anterior ate a nova ficar pronta
+        if lock.acquire(blocking=False):
+            self._reloading[path] = threading.Thread(
+                target=self._reload_in_background,
+                args=(path, manifest_path, key, lock),
+                daemon=True,
+            )
+            self._reloading[path].start()
+
+        return cached[1]
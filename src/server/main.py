@@ -1,24 +1,99 @@
-from flask import Flask, render_template, request
+from flask import Flask, make_response, render_template, request
+from werkzeug.http import is_resource_modified
 
 
 app = Flask(__name__)
 
+import hashlib
 import json
+import re
+from datetime import datetime
 import pandas as pd
 import os
 import yaml
 
+from datasets import Datasets, ENCODINGS, INDEXED_COLUMNS
 
-def _load_data(entry, query_parameters):
-    path = "/".join([os.getenv("OUTPUT_DIR"), entry.replace("/", "-")]) + ".csv"
-    data = pd.read_csv(path)
-    if query_parameters.get('state_id'):
-        data = data[data["state_id"]==query_parameters.get('state_id')]
-    if query_parameters.get('city_id'):
-        data = data[data["city_id"]==query_parameters.get('city_id')]
-    if query_parameters.get('city_name'):
-        data = data[data["city_name"]==query_parameters.get('city_name')]
-    return data.to_csv(index=False)
+# Tabelas mantidas em memoria entre as requisicoes
+datasets = Datasets(os.getenv("OUTPUT_DIR"))
+
+# Clientes podem reusar a resposta ate a proxima atualizacao dos dados
+CACHE_MAX_AGE = int(os.getenv("REFRESH_RATE_MINUTES", 10)) * 60
+
+
+def _is_date(value):
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        return False
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return False
+    return True
+
+
+def _invalid_parameters(table, query_parameters):
+    """Mensagem do erro nos parametros de periodo e colunas, ou None."""
+
+    periods = [col for col in ["since", "until"] if query_parameters.get(col)]
+    if query_parameters.get("is_last", "").lower() == "true":
+        periods.append("is_last")
+    if periods and table.dates is None:
+        return "{} requires a table with last_updated".format(", ".join(periods))
+    if "is_last" in periods and table.last_rows is None:
+        return "is_last requires a table with is_last or a place id"
+
+    # Periodos comparados como texto com last_updated: so datas YYYY-MM-DD
+    for col in ["since", "until"]:
+        value = query_parameters.get(col)
+        if value and not _is_date(value):
+            return "{} must be a date as YYYY-MM-DD, got {!r}".format(col, value)
+
+    unknown = [
+        col
+        for col in query_parameters.get("columns", "").split(",")
+        if col and col not in table.columns
+    ]
+    if unknown:
+        return "unknown columns: {}".format(", ".join(unknown))
+
+    return None
+
+
+def _load_data(table, query_parameters, encoding=None):
+    filters = {
+        col: query_parameters.get(col)
+        for col in INDEXED_COLUMNS
+        if query_parameters.get(col)
+    }
+    # ex: ?columns=city_id,last_updated,rt_10_days&since=2020-08-01&is_last=true
+    columns = [col for col in query_parameters.get("columns", "").split(",") if col]
+    return table.body(
+        filters,
+        encoding,
+        columns=columns,
+        since=query_parameters.get("since"),
+        until=query_parameters.get("until"),
+        is_last=query_parameters.get("is_last", "").lower() == "true",
+    )
+
+
+def _etag(table, query_parameters, encoding=None):
+    # Muda com a versao do dado, com os filtros pedidos e com a compressao
+    key = repr((table.version, sorted(query_parameters.items(multi=True))))
+    etag = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return etag + "-" + encoding if encoding else etag
+
+
+def _cached_response(table, body, etag, encoding=None, status=200):
+    response = make_response(body, status)
+    if encoding and status == 200:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    response.last_modified = table.last_refreshed
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response
 
 
 @app.route('/<path:entry>', methods=['GET'])
@@ -27,13 +102,32 @@ def index(entry):
         return "This is an API"  # for example
     else:
         try:
-            return _load_data(entry, request.args)
+            # Comprime se o cliente aceitar (Accept-Encoding)
+            encoding = request.accept_encodings.best_match(ENCODINGS)
+
+            table = datasets.get(entry)
+
+            error = _invalid_parameters(table, request.args)
+            if error:
+                return make_response(error, 400)
+
+            etag = _etag(table, request.args, encoding)
+
+            # 304 sem montar o corpo se o cliente ja tem esta versao
+            # (If-None-Match/If-Modified-Since)
+            if not is_resource_modified(
+                request.environ, etag=etag, last_modified=table.last_refreshed
+            ):
+                return _cached_response(table, b"", etag, encoding, status=304)
+
+            body = _load_data(table, request.args, encoding)
+            return _cached_response(table, body, etag, encoding)
 
         except FileNotFoundError:
             endpoints = [
                 d.split(".")[0].replace("-", "/")
                 for d in os.listdir(os.getenv("OUTPUT_DIR"))
-                if "inloco" not in d
+                if "inloco" not in d and d.endswith(".csv")
             ]
             return render_template("not-found.html", endpoints=endpoints, query_parameters=request.args)
 
@@ -0,0 +1,140 @@
+"""
+Tamanho e latencia (p99) das respostas do servidor e da leitura anterior do CSV a
+cada requisicao (read_csv, filtro, to_csv), numa tabela de casos de cidades
+gerada. A leitura anterior compara city_id (inteiro) com o texto da url, entao
+responde so o cabecalho no filtro por cidade. Rodar de src/server:
+
+    python tests/benchmarks/responses.py [linhas]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import main
+from datasets import ENCODINGS, Datasets
+
+QUERIES = {
+    "full file": {},
+    "state slice": {"state_id": "SP"},
+    "city slice": {"city_id": "3500007"},
+    "columns + since": {"columns": "city_id,last_updated,rt", "since": "2020-08-01"},
+}
+
+
+def cities_cases(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+
+    n_days = 180
+    n_cities = max(1, n_rows // n_days)
+    df = pd.DataFrame(
+        {
+            "state_id": np.repeat(
+                rng.choice(["SP", "MG", "RJ", "BA", "RS", "AC"], n_cities), n_days
+            ),
+            "city_id": np.repeat(np.arange(3500000, 3500000 + n_cities), n_days),
+            "city_name": np.repeat(
+                ["Cidade {}".format(i) for i in range(n_cities)], n_days
+            ),
+            "last_updated": np.tile(
+                pd.date_range("2020-03-01", periods=n_days).strftime("%Y-%m-%d"),
+                n_cities,
+            ),
+        }
+    )
+    for col in ["daily_cases", "deaths", "active_cases"]:
+        df[col] = rng.integers(0, 1000, len(df))
+    for col in ["rt", "notification_rate", "daily_cases_mavg"]:
+        df[col] = np.round(rng.random(len(df)) * 2, 6)
+    df["data_last_refreshed"] = "2020-09-01 10:00:00"
+    return df
+
+
+def old_load_data(path, query_parameters):
+    data = pd.read_csv(path)
+    for col in ["state_id", "city_id", "city_name"]:
+        if query_parameters.get(col):
+            data = data[data[col] == query_parameters.get(col)]
+    return data.to_csv(index=False)
+
+
+def p99(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return np.percentile(times, 99) * 1000, result
+
+
+def resident_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024
+
+
+if __name__ == "__main__":
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    output_dir = tempfile.mkdtemp()
+    path = os.path.join(output_dir, "br-cities-cases-full.csv")
+    cities_cases(n_rows).to_csv(path, index=False)
+    print(
+        "{} rows, {:.1f} MB, encodings {}".format(
+            n_rows, os.path.getsize(path) / 1e6, ENCODINGS
+        )
+    )
+
+    main.datasets = Datasets(output_dir)
+    client = main.app.test_client()
+
+    before = resident_mb()
+    start = time.perf_counter()
+    main.datasets.get("br/cities/cases/full")
+    print(
+        "load and precompress: {:.1f} s, +{:.0f} MB resident".format(
+            time.perf_counter() - start, resident_mb() - before
+        )
+    )
+
+    for name, query in QUERIES.items():
+        # A leitura anterior so filtrava pelos ids
+        line = "{:16} old {:>9} {:>9} |".format(name, "-", "-")
+        if set(query) <= {"state_id", "city_id", "city_name"}:
+            old, body = p99(lambda: old_load_data(path, query), 5)
+            line = "{:16} old {:>6.0f} KB {:>6.0f} ms |".format(
+                name, len(body) / 1e3, old
+            )
+
+        for encoding in ["identity"] + ENCODINGS:
+
+            def get():
+                return client.get(
+                    "/br/cities/cases/full",
+                    query_string=query,
+                    headers={"Accept-Encoding": encoding},
+                )
+
+            new, response = p99(get, 50)
+            line += " {} {:.0f} KB {:.1f} ms |".format(
+                encoding, len(response.data) / 1e3, new
+            )
+
+        etag = response.headers["ETag"]
+        revalidate, response = p99(
+            lambda: client.get(
+                "/br/cities/cases/full",
+                query_string=query,
+                headers={"Accept-Encoding": encoding, "If-None-Match": etag},
+            ),
+            50,
+        )
+        assert response.status_code == 304
+        print(line + " 304 {:.1f} ms".format(revalidate))
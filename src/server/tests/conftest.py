@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os modulos do servidor sao importados a partir de src/server, como no container
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,141 @@
+import hashlib
+import io
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+from datasets import Datasets, Table
+
+
+def _cases(n_cities=40, n_days=30, seed=0):
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame(
+        {
+            "state_id": np.repeat(rng.choice(["SP", "RJ", "AC"], n_cities), n_days),
+            "city_id": np.repeat(np.arange(3500000, 3500000 + n_cities), n_days),
+            "city_name": np.repeat(
+                ["Cidade {}, Nova".format(i) for i in range(n_cities)], n_days
+            ),
+            "last_updated": np.tile(
+                pd.date_range("2020-08-01", periods=n_days).strftime("%Y-%m-%d"),
+                n_cities,
+            ),
+            "daily_cases": rng.integers(0, 500, n_cities * n_days),
+            "rt": np.round(rng.random(n_cities * n_days) * 2, 6),
+            "data_last_refreshed": "2020-09-01 10:00:00",
+        }
+    )
+    df.loc[::17, "rt"] = np.nan
+    return df
+
+
+def _read(body):
+    return pd.read_csv(io.BytesIO(body), dtype=str)
+
+
+def test_only_index_and_filter_columns_are_parsed():
+    df = _cases()
+    table = Table(df.to_csv(index=False).encode("utf-8"), "v1")
+
+    assert not hasattr(table, "data")
+    assert table.n_rows == len(df)
+    assert table.columns == list(df.columns)
+    assert table.last_refreshed.isoformat() == "2020-09-01T10:00:00+00:00"
+
+
+def test_columns_are_projected_from_the_raw_rows():
+    df = _cases()
+    expected = df.astype(str).where(df.notnull())
+    table = Table(df.to_csv(index=False).encode("utf-8"))
+
+    body = table.body({}, columns=["rt", "city_id", "nope"])
+    pd.testing.assert_frame_equal(_read(body), expected[["rt", "city_id"]])
+
+    body = table.body(
+        {"state_id": "SP"}, columns=["city_name", "rt"], since="2020-08-20"
+    )
+    rows = expected[
+        (expected["state_id"] == "SP") & (expected["last_updated"] >= "2020-08-20")
+    ]
+    pd.testing.assert_frame_equal(
+        _read(body), rows[["city_name", "rt"]].reset_index(drop=True)
+    )
+
+
+def test_rows_with_line_breaks_are_reread_with_pandas():
+    df = _cases(n_cities=3, n_days=5)
+    df.loc[2, "city_name"] = "Linha\nquebrada"
+    table = Table(df.to_csv(index=False).encode("utf-8"))
+
+    assert table.starts is None and table.n_rows == len(df)
+
+    body = table.body({"city_id": "3500000"}, columns=["city_name"])
+    assert _read(body)["city_name"].tolist()[2] == "Linha\nquebrada"
+    assert len(_read(table.body({"city_id": "3500000"}))) == 5
+
+
+def _publish(tmp_path, df, version=None):
+    """CSV e, se `version`, manifesto, como o loader publica."""
+
+    raw = df.to_csv(index=False).encode("utf-8")
+    (tmp_path / "br-cities-cases.csv").write_bytes(raw)
+
+    if version:
+        manifest = {
+            "version": version,
+            "rows": len(df),
+            "sha256": hashlib.sha256(raw).hexdigest(),
+        }
+        (tmp_path / "br-cities-cases.manifest.json").write_text(json.dumps(manifest))
+
+
+def _get(datasets, entry="br/cities/cases"):
+    """Tabela servida depois do carregamento em segundo plano, se houver."""
+
+    datasets.get(entry)
+    for thread in list(datasets._reloading.values()):
+        thread.join(10)
+    return datasets.get(entry)
+
+
+def test_new_csv_is_served_only_with_its_manifest(tmp_path):
+    _publish(tmp_path, _cases(n_cities=4), version="1")
+    datasets = Datasets(str(tmp_path))
+    assert datasets.get("br/cities/cases").version == "1"
+
+    # CSV novo, manifesto ainda da versao anterior
+    _publish(tmp_path, _cases(n_cities=6))
+    table = _get(datasets)
+    assert table.version == "1" and table.n_rows == 4 * 30
+
+    _publish(tmp_path, _cases(n_cities=6), version="20")
+    table = _get(datasets)
+    assert table.version == "20" and table.n_rows == 6 * 30
+
+
+def test_new_version_is_loaded_while_requests_get_the_previous(tmp_path, monkeypatch):
+    _publish(tmp_path, _cases(n_cities=4), version="1")
+    datasets = Datasets(str(tmp_path))
+    datasets.get("br/cities/cases")
+
+    loading, release = threading.Event(), threading.Event()
+    load = Datasets._load
+
+    def slow_load(self, *args):
+        loading.set()
+        release.wait(10)
+        return load(self, *args)
+
+    monkeypatch.setattr(Datasets, "_load", slow_load)
+    _publish(tmp_path, _cases(n_cities=6), version="20")
+
+    assert datasets.get("br/cities/cases").version == "1"
+    assert loading.wait(10)
+    assert datasets.get("br/cities/cases").version == "1"
+    assert len(datasets._reloading) == 1
+
+    release.set()
+    assert _get(datasets).version == "20"
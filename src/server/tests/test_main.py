@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+
+import main
+from datasets import Datasets, Table
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pd.DataFrame(
+        {
+            "state_id": ["SP", "SP", "AC"],
+            "city_id": [3550308, 3550308, 1200013],
+            "last_updated": ["2020-08-01", "2020-08-02", "2020-08-02"],
+            "rt": [1.1, 0.9, 1.3],
+            "data_last_refreshed": "2020-09-01 10:00:00",
+        }
+    ).to_csv(tmp_path / "br-cities-rt.csv", index=False)
+
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "datasets", Datasets(str(tmp_path)))
+    return main.app.test_client()
+
+
+def test_not_modified_is_answered_before_building_the_body(client, monkeypatch):
+    first = client.get("/br/cities/rt?state_id=SP")
+    assert first.status_code == 200
+    assert first.data.count(b"\n") == 3
+
+    bodies = []
+    monkeypatch.setattr(
+        Table, "body", lambda self, *args, **kwargs: bodies.append(args) or b""
+    )
+
+    again = client.get(
+        "/br/cities/rt?state_id=SP", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert again.status_code == 304
+    assert again.data == b""
+    assert bodies == []
+    for header in ["ETag", "Cache-Control", "Vary"]:
+        assert again.headers[header] == first.headers[header]
+
+    since = client.get(
+        "/br/cities/rt?state_id=SP",
+        headers={"If-Modified-Since": first.headers["Last-Modified"]},
+    )
+    assert since.status_code == 304 and bodies == []
+
+    # Outros filtros, outro ETag: corpo montado
+    other = client.get(
+        "/br/cities/rt?state_id=AC", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert other.status_code == 200 and len(bodies) == 1
+
+
+def test_etag_depends_on_the_encoding(client):
+    plain = client.get("/br/cities/rt")
+    gzipped = client.get("/br/cities/rt", headers={"Accept-Encoding": "gzip"})
+
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert plain.headers["ETag"] != gzipped.headers["ETag"]
+
+    again = client.get(
+        "/br/cities/rt",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]},
+    )
+    assert again.status_code == 304
+    assert "Content-Encoding" not in again.headers
+
+
+def test_invalid_parameters_are_rejected(client, tmp_path):
+    pd.DataFrame({"state_id": ["SP"], "population": [100]}).to_csv(
+        tmp_path / "br-states-population.csv", index=False
+    )
+
+    for url, message in [
+        ("/br/cities/rt?since=01/08/2020", b"since must be a date as YYYY-MM-DD"),
+        ("/br/cities/rt?until=2020-8-1", b"until must be a date as YYYY-MM-DD"),
+        ("/br/cities/rt?since=2020-02-30", b"since must be a date as YYYY-MM-DD"),
+        ("/br/cities/rt?columns=city_id,rt_10,x", b"unknown columns: rt_10, x"),
+        ("/br/states/population?since=2020-08-01", b"since requires a table with"),
+        ("/br/states/population?is_last=true", b"is_last requires a table with"),
+    ]:
+        response = client.get(url)
+        assert response.status_code == 400, url
+        assert response.data.startswith(message), url
+
+    ok = client.get("/br/cities/rt?columns=city_id,rt&since=2020-08-02&is_last=true")
+    assert ok.status_code == 200
+    assert ok.data == b"city_id,rt\n3550308,0.9\n1200013,1.3\n"
+    assert client.get("/br/states/population?is_last=false").status_code == 200